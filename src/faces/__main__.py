@@ -1,7 +1,15 @@
 from pathlib import Path
 
-from .application import Web
+from .infrastructure.support import StartupReport
+
+# Started before importing the application, so that the report covers SQLAlchemy, Werkzeug and Jinja
+startup = StartupReport()
+
+from .application import Web  # noqa: E402
 
 if __name__ == '__main__':
+    startup.record('import')
     root_dir = Path(__file__).parent.parent
-    Web.create(root_dir).run()
+    web = Web.create(root_dir, startup)
+    startup.record('configure')
+    web.run()
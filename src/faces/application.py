@@ -1,3 +1,11 @@
+import bisect
+import contextlib
+import csv
+import io
+import logging
+import threading
+from collections.abc import Sequence
+from contextvars import ContextVar
 from dataclasses import dataclass
 
 import sqlalchemy
@@ -5,54 +13,235 @@ import sqlalchemy.exc
 import sqlalchemy.schema
 
 from .infrastructure.database import Database
+from .infrastructure.events import EventHub
 from .infrastructure.http_server import HttpServer
-from .infrastructure.support import OutputTracker
+from .infrastructure.migrations import Migration, Migrator
+from .infrastructure.support import Cache, OutputTracker, setting
+
+
+PAGE_SIZE = 100
+SEARCH_LIMIT = 20
+READ_CHUNK = 1000
 
 
 class App:
-    def __init__(self, repository):
+    def __init__(self, repository, output_tracker=None, lifecycle=None):
         self._repository = repository
-        self.output_tracker = OutputTracker()
+        self.output_tracker = output_tracker or OutputTracker()
+        self._project_listeners = []
+        self._created = ContextVar('created', default=())
+        self._announce_on_commit = lifecycle is not None
+        if lifecycle:
+            lifecycle.add_request_listener(success=self._on_commit, failure=self._on_rollback)
 
     @classmethod
     def create(cls, lifecycle):
-        return cls(Repository.create(lifecycle))
+        if setting('storage', 'sqlite') == 'memory':
+            repository = InMemoryRepository.create(lifecycle)
+        else:
+            repository = Repository.create(lifecycle)
+        return cls(repository, OutputTracker.create(), lifecycle)
 
     @classmethod
     def create_null(cls, projects=None):
-        return cls(Repository.create_null(projects=projects))
+        return cls(InMemoryRepository.create_null(projects=projects))
 
     def all_projects(self):
         return self._repository.all_projects()
 
+    def projects_page(self, after=None, limit=PAGE_SIZE):
+        return self._repository.projects_page(after=after, limit=limit)
+
+    def projects_version(self):
+        return self._repository.projects_version()
+
+    def iter_projects(self, after=None, page_size=PAGE_SIZE):
+        while True:
+            page = self._repository.projects_page(after=after, limit=page_size)
+            yield from page.projects
+            if page.next_after is None:
+                return
+            after = page.next_after
+
+    def search_projects(self, query, limit=SEARCH_LIMIT):
+        return self._repository.search_projects(query, limit=limit)
+
     def create_project(self, name):
         project = Project(name)
         self._repository.save_project(project)
         self.output_tracker.add(project)
+        self._announce([project])
+        return project
 
+    def create_projects(self, names):
+        projects = [Project(name) for name in names]
+        self._repository.save_projects(projects)
+        self.output_tracker.add_batch(projects)
+        self._announce(projects)
 
-@dataclass
+    def add_project_listener(self, listener):
+        self._project_listeners.append(listener)
+
+    def _announce(self, projects):
+        # Listeners only hear about projects once they are committed
+        if self._announce_on_commit:
+            self._created.set(self._created.get() + tuple(projects))
+            return
+        for project in projects:
+            self._notify(project)
+
+    def _on_commit(self):
+        created = self._created.get()
+        self._created.set(())
+        for project in created:
+            self._notify(project)
+
+    def _on_rollback(self):
+        self._created.set(())
+
+    def _notify(self, project):
+        for listener in self._project_listeners:
+            listener(project)
+
+
+@dataclass(slots=True)
 class Project:
     name: str
 
 
+class ProjectList(Sequence):
+    # Holds only the names read from the database; each Project is made as it is iterated,
+    # so a page renders without a second list of objects the size of the table
+    __slots__ = ('_names',)
+
+    def __init__(self, names):
+        self._names = names
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ProjectList(self._names[index])
+        return Project(self._names[index])
+
+    def __iter__(self):
+        return map(Project, self._names)
+
+    def __eq__(self, other):
+        if isinstance(other, ProjectList):
+            return self._names == other._names
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self):
+        return f'ProjectList({self._names!r})'
+
+
+class DuplicateProject(ValueError):
+    pass
+
+
+@dataclass
+class Page:
+    projects: Sequence[Project]
+    next_after: str | None
+
+
 @dataclass
 class Tables:
-    projects = sqlalchemy.Table('projects', sqlalchemy.MetaData(),
-                                sqlalchemy.Column('name', sqlalchemy.Text))
+    projects = sqlalchemy.Table(
+        'projects', sqlalchemy.MetaData(),
+        sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+        sqlalchemy.Column('name', sqlalchemy.Text, nullable=False),
+        sqlalchemy.Column('created_at', sqlalchemy.DateTime, nullable=False,
+                          server_default=sqlalchemy.func.current_timestamp()),
+        sqlalchemy.Index('ix_projects_name', 'name', unique=True),
+    )
 tables = Tables()
 
 
+_legacy_projects = sqlalchemy.Table('projects', sqlalchemy.MetaData(),
+                                    sqlalchemy.Column('name', sqlalchemy.Text))
+
+
+def _create_projects(database):
+    if database.has_table('projects'):
+        return
+    database.execute(sqlalchemy.schema.CreateTable(_legacy_projects))
+    database.execute(sqlalchemy.insert(_legacy_projects).values([{'name': 'foo'}, {'name': 'bar'}]))
+
+
+def _add_project_ids_and_creation_times(database):
+    # SQLite can't add a primary key to an existing table, so copy the projects into a new one,
+    # keeping the first of any duplicated names so that they can be uniquely indexed
+    rebuilt = tables.projects.to_metadata(sqlalchemy.MetaData(), name='projects_rebuilt')
+    database.execute(sqlalchemy.schema.DropTable(rebuilt, if_exists=True))
+    database.execute(sqlalchemy.schema.CreateTable(rebuilt))
+
+    name = _legacy_projects.c.name
+    first_seen = (sqlalchemy.select(name).where(name.is_not(None)).group_by(name)
+                  .order_by(sqlalchemy.func.min(sqlalchemy.literal_column('rowid'))))
+    database.execute(sqlalchemy.insert(rebuilt).from_select(['name'], first_seen))
+
+    database.execute(sqlalchemy.schema.DropTable(_legacy_projects))
+    database.execute(sqlalchemy.text('ALTER TABLE projects_rebuilt RENAME TO projects'))
+
+
+def _index_project_names(database):
+    for index in tables.projects.indexes:
+        database.execute(sqlalchemy.schema.CreateIndex(index))
+
+
+_project_search = sqlalchemy.table('projects_search', sqlalchemy.column('rowid'), sqlalchemy.column('rank'))
+
+
+def _add_project_search(database):
+    if database.dialect_name != 'sqlite':
+        return
+    # An external-content FTS5 index over projects.name, kept in step with the table by triggers
+    for statement in [
+        "CREATE VIRTUAL TABLE projects_search USING fts5(name, content='projects', content_rowid='id')",
+        "CREATE TRIGGER projects_search_insert AFTER INSERT ON projects BEGIN "
+        "INSERT INTO projects_search(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER projects_search_delete AFTER DELETE ON projects BEGIN "
+        "INSERT INTO projects_search(projects_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER projects_search_update AFTER UPDATE ON projects BEGIN "
+        "INSERT INTO projects_search(projects_search, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO projects_search(rowid, name) VALUES (new.id, new.name); END",
+        "INSERT INTO projects_search(projects_search) VALUES ('rebuild')",
+    ]:
+        database.execute(sqlalchemy.text(statement))
+
+
+MIGRATIONS = [
+    Migration(1, 'create projects', _create_projects),
+    Migration(2, 'add project ids and creation times', _add_project_ids_and_creation_times),
+    Migration(3, 'index project names', _index_project_names),
+    Migration(4, 'add project search', _add_project_search),
+]
+
+
 class Repository:
-    def __init__(self, database, lifecycle=None):
+    def __init__(self, database, lifecycle=None, cache=None, output_tracker=None):
         self._database = database
+        self._cache = cache
+        self._cached_version = None
+        self._wrote = ContextVar('wrote', default=False)
+        self._invalidate_on_commit = lifecycle is not None
         if lifecycle:
             lifecycle.add_start_listener(self.initialize)
-        self.output_tracker = OutputTracker()
+            lifecycle.add_request_listener(success=self._on_commit, failure=self._on_rollback)
+            if cache:
+                lifecycle.metrics.add_collector(self._collect_cache_metrics)
+        self.output_tracker = output_tracker or OutputTracker()
 
     @classmethod
     def create(cls, lifecycle):
-        return cls(Database.create(lifecycle), lifecycle)
+        cache = Cache(
+            max_entries=setting('cache_entries', 256, int),
+            ttl=setting('cache_ttl', 5.0, float),
+        )
+        return cls(Database.create(lifecycle), lifecycle, cache, OutputTracker.create())
 
     @classmethod
     def create_null(cls, projects=None):
@@ -61,54 +250,333 @@ class Repository:
         return cls(Database.create_null(response=data))
 
     def initialize(self):
-        try:
-            self._database.execute(sqlalchemy.select(tables.projects.c.name))
-        except sqlalchemy.exc.OperationalError:
-            self._database.execute(sqlalchemy.schema.CreateTable(tables.projects))
-            self._database.execute(
-                sqlalchemy.insert(tables.projects).values([{'name': 'foo'}, {'name': 'bar'}])
-            )
-            self._database.commit()
+        Migrator(self._database, MIGRATIONS).run()
 
     def all_projects(self):
-        result = self._database.execute(sqlalchemy.select(tables.projects.c.name))
-        projects = [Project(row.name) for row in result]
-        return projects
+        return self._read('all_projects', self._load_all_projects)
+
+    def _load_all_projects(self):
+        result = self._database.read(sqlalchemy.select(tables.projects.c.name))
+        return ProjectList(_read_names(result))
+
+    def projects_page(self, after=None, limit=PAGE_SIZE):
+        return self._read(('projects_page', after, limit), lambda: self._load_projects_page(after, limit))
+
+    def _load_projects_page(self, after, limit):
+        name = tables.projects.c.name
+        query = sqlalchemy.select(name).order_by(name).limit(limit + 1)
+        if after is not None:
+            query = query.where(name > after)
+        names = _read_names(self._database.read(query))
+        projects = ProjectList(names[:limit])
+        next_after = names[limit - 1] if len(names) > limit else None
+        return Page(projects, next_after)
+
+    def projects_version(self):
+        # Not cached: another worker process may have just added a project, and max(id) is a primary key lookup.
+        # Projects are never deleted, so the highest id changes whenever the list does
+        result = self._database.read(sqlalchemy.select(sqlalchemy.func.max(tables.projects.c.id)))
+        version = next(iter(result), (0,))[0] or 0
+        if self._cache is not None and version != self._cached_version:
+            # Another worker's write only clears that worker's cache, so pages cached here may predate it
+            self._cache.clear()
+            self._cached_version = version
+        return version
+
+    def search_projects(self, query, limit=SEARCH_LIMIT):
+        terms = query.split()
+        if not terms:
+            return []
+        return self._read(('search_projects', tuple(terms), limit), lambda: self._load_search(terms, limit))
+
+    def _load_search(self, terms, limit):
+        name = tables.projects.c.name
+        if self._database.dialect_name == 'sqlite':
+            # Each term is quoted, so FTS5 query syntax in the input is matched literally
+            match = ' '.join('"' + term.replace('"', '""') + '"*' for term in terms)
+            query = (sqlalchemy.select(name)
+                     .join(_project_search, _project_search.c.rowid == tables.projects.c.id)
+                     .where(sqlalchemy.literal_column('projects_search').op('MATCH')(match))
+                     .order_by(_project_search.c.rank))
+        else:
+            query = (sqlalchemy.select(name)
+                     .where(*[name.icontains(term, autoescape=True) for term in terms])
+                     .order_by(name))
+        result = self._database.read(query.limit(limit))
+        return ProjectList(_read_names(result))
 
     def save_project(self, project):
         s = sqlalchemy.insert(tables.projects).values(name=project.name)
-        self._database.execute(s)
+        with _duplicate_names():
+            self._database.write(s)
+        self._written()
         self.output_tracker.add(project)
 
+    def save_projects(self, projects):
+        if not projects:
+            return
+        rows = [{'name': project.name} for project in projects]
+        with _duplicate_names():
+            self._database.write(sqlalchemy.insert(tables.projects), rows)
+        self._written()
+        self.output_tracker.add_batch(projects)
+
+    def cache_stats(self):
+        return self._cache.stats() if self._cache else None
+
+    def _collect_cache_metrics(self):
+        stats = self._cache.stats()
+        yield 'project_cache_hits_total', 'counter', 'Project reads served from the cache', (), stats['hits']
+        yield 'project_cache_misses_total', 'counter', 'Project reads that went to the database', (), stats['misses']
+        yield 'project_cache_entries', 'gauge', 'Entries in the project cache', (), stats['entries']
+
+    def _read(self, key, load):
+        # A request that has written must see its own uncommitted changes
+        if self._cache is None or self._wrote.get():
+            return load()
+        return self._cache.get(key, load)
+
+    def _written(self):
+        if self._cache is None:
+            return
+        if self._invalidate_on_commit:
+            self._wrote.set(True)
+        else:
+            self._cache.clear()
+
+    def _on_commit(self):
+        if self._wrote.get():
+            self._cache.clear()
+            self._wrote.set(False)
+
+    def _on_rollback(self):
+        self._wrote.set(False)
+
+
+@contextlib.contextmanager
+def _duplicate_names():
+    try:
+        yield
+    except sqlalchemy.exc.IntegrityError as e:
+        raise DuplicateProject('Project names must be unique') from e
+
+
+def _read_names(result):
+    # Rows are fetched a chunk at a time, so the driver never holds the whole table as row objects
+    names = []
+    while rows := result.fetchmany(READ_CHUNK):
+        names.extend(name for name, in rows)
+    return names
+
+
+class InMemoryRepository:
+    # Projects live only as long as the process: a hash index for uniqueness, a sorted index
+    # for paging and search, and the creation order for listing
+    def __init__(self, projects=None, lifecycle=None, output_tracker=None):
+        self._by_name = {}
+        self._names = []
+        self._created = []
+        # Bumped on every change, rollbacks included, so a version never stands for two different lists
+        self._version = 0
+        self._lock = threading.Lock()
+        self._saved = ContextVar('saved', default=())
+        self._undo_on_rollback = lifecycle is not None
+        if lifecycle:
+            lifecycle.add_request_listener(success=self._on_commit, failure=self._on_rollback)
+        self.output_tracker = output_tracker or OutputTracker()
+        for project in projects or []:
+            self._insert(project)
+
+    @classmethod
+    def create(cls, lifecycle):
+        return cls(lifecycle=lifecycle, output_tracker=OutputTracker.create())
+
+    @classmethod
+    def create_null(cls, projects=None):
+        return cls(projects)
+
+    def initialize(self):
+        pass
+
+    def all_projects(self):
+        with self._lock:
+            return list(self._created)
+
+    def projects_page(self, after=None, limit=PAGE_SIZE):
+        with self._lock:
+            start = 0 if after is None else bisect.bisect_right(self._names, after)
+            names = self._names[start:start + limit + 1]
+            projects = [self._by_name[name] for name in names[:limit]]
+        next_after = projects[-1].name if len(names) > limit else None
+        return Page(projects, next_after)
+
+    def projects_version(self):
+        with self._lock:
+            return self._version
+
+    def search_projects(self, query, limit=SEARCH_LIMIT):
+        terms = [term.casefold() for term in query.split()]
+        if not terms:
+            return []
+        found = []
+        with self._lock:
+            for name in self._names:
+                if all(term in name.casefold() for term in terms):
+                    found.append(self._by_name[name])
+                    if len(found) == limit:
+                        break
+        return found
+
+    def save_project(self, project):
+        self._insert(project)
+        self._saved_in_request([project])
+        self.output_tracker.add(project)
+
+    def save_projects(self, projects):
+        if not projects:
+            return
+        with self._lock:
+            # All or nothing, like the single insert statement of the database repository
+            names = [project.name for project in projects]
+            if len(set(names)) < len(names) or any(name in self._by_name for name in names):
+                raise DuplicateProject('Project names must be unique')
+            for project in projects:
+                self._add(project)
+        self._saved_in_request(projects)
+        self.output_tracker.add_batch(projects)
+
+    def cache_stats(self):
+        return None
+
+    def _insert(self, project):
+        with self._lock:
+            if project.name in self._by_name:
+                raise DuplicateProject(f'Project {project.name!r} already exists')
+            self._add(project)
+
+    def _add(self, project):
+        self._by_name[project.name] = project
+        bisect.insort(self._names, project.name)
+        self._created.append(project)
+        self._version += 1
+
+    def _saved_in_request(self, projects):
+        if self._undo_on_rollback:
+            self._saved.set(self._saved.get() + tuple(projects))
+
+    def _on_commit(self):
+        self._saved.set(())
+
+    def _on_rollback(self):
+        # Other requests may already have read them; there is no isolation, only atomicity
+        saved = self._saved.get()
+        self._saved.set(())
+        with self._lock:
+            for project in saved:
+                del self._by_name[project.name]
+                del self._names[bisect.bisect_left(self._names, project.name)]
+                self._created.remove(project)
+            if saved:
+                self._version += 1
+
 
 class Web:
-    def __init__(self, server, app, root_dir):
+    def __init__(self, server, app, root_dir, events=None, live_updates=True):
         self._app = app
         self._server = server
+        self._events = (events or EventHub()) if live_updates else None
+        routes = [
+            ('/', self.on_index, ['GET']),
+            ('/project', self.on_create_project, ['PUT']),
+            ('/projects', self.on_create_projects, ['POST']),
+            ('/projects/search', self.on_search_projects, ['GET']),
+        ]
+        if live_updates:
+            self._app.add_project_listener(self._publish_project)
+            routes.append(('/events', self.on_events, ['GET']))
 
         self._server.configure(
-            routes=[
-                ('/', self.on_index, ['GET']),
-                ('/project', self.on_create_project, ['PUT']),
-            ],
+            routes=routes,
             statics={'/static': root_dir / 'static'},
-            templates=(root_dir / 'templates')
+            templates=(root_dir / 'templates'),
+            # Under overload bulk imports are turned away first, so that pages keep being served
+            priorities={'on_create_projects': 'low'},
+            errors={
+                DuplicateProject: self.on_duplicate_project,
+                # With group commit the insert only runs at commit, where the database's own error is raised
+                sqlalchemy.exc.IntegrityError: self.on_duplicate_project,
+            },
         )
 
     @classmethod
-    def create(cls, root_dir):
-        server = HttpServer.create()
+    def create(cls, root_dir, startup=None):
+        if setting('server', 'wsgi') == 'asgi':
+            from .infrastructure.asgi_server import AsgiHttpServer  # asyncio is only needed by this server
+            server = AsgiHttpServer.create(startup)
+        else:
+            server = HttpServer.create(startup)
+        if setting('storage', 'sqlite') == 'memory' and server.processes > 1:
+            # Each worker would keep, and show, a project list of its own
+            raise SystemExit(f'FACES_STORAGE=memory needs a single process, not FACES_PROCESSES={server.processes}')
         app = App.create(server.lifecycle)
-        return cls(server, app, root_dir)
+        # Every open page keeps a stream, which only the ASGI server holds without a thread; elsewhere
+        # pages are left to pick up changes on reload
+        live_updates = server.cheap_event_streams
+        if not live_updates:
+            logging.getLogger('faces').info('Live project updates are off; they need FACES_SERVER=asgi')
+        return cls(server, app, root_dir, EventHub.create(), live_updates)
 
-    def on_index(self, _request):
-        projects = self._app.all_projects()
-        return self._server.render('projects', projects=projects)
+    def on_index(self, request):
+        etag = f'projects-{self._app.projects_version()}'
+        not_modified = self._server.not_modified(request, etag)
+        if not_modified:
+            return not_modified
+
+        projects = self._app.iter_projects(after=request.args.get('after'))
+        return self._server.render('projects', stream=True, etag=etag, projects=projects,
+                                   live_updates=self._events is not None)
+
+    def on_search_projects(self, request):
+        projects = self._app.search_projects(request.args.get('q', ''))
+        return self._server.render('search_results', projects=projects)
 
     def on_create_project(self, request):
-        name = request.form['name']
-        self._app.create_project(name)
+        project = self._app.create_project(request.form['name'])
+        if self._server.is_partial(request):
+            # htmx appends the new item to the list, so there is no redirect or full re-render
+            return self._server.render('projects', block='project', project=project)
         return self._server.redirect('on_index')
 
-    def run(self):
-        self._server.run()
+    def on_duplicate_project(self, request, _error):
+        message = 'A project with that name already exists'
+        if self._server.is_partial(request):
+            # htmx shows the message next to the form instead of appending to the list
+            return self._server.render('projects', block='project_error', status=409, message=message,
+                                       headers={'HX-Retarget': '#project-error', 'HX-Reswap': 'innerHTML'})
+        return self._server.json({'error': message}, status=409)
+
+    def on_events(self, _request):
+        return self._server.stream_events(self._events)
+
+    def _publish_project(self, project):
+        # Rendered once here rather than once per subscriber
+        self._events.publish('project', self._server.render_block('projects', 'project', project=project))
+
+    def on_create_projects(self, request):
+        if request.mimetype == 'application/json':
+            data = request.get_json()
+            names = data.get('names') if isinstance(data, dict) else data
+        elif request.mimetype == 'text/csv':
+            rows = csv.reader(io.StringIO(request.get_data(as_text=True)))
+            names = [row[0].strip() for row in rows if row and row[0].strip()]
+        else:
+            return self._server.json({'error': 'Expected an application/json or text/csv body'}, status=415)
+
+        if not isinstance(names, list) or not all(isinstance(name, str) and name for name in names):
+            return self._server.json({'error': 'Expected a list of project names'}, status=400)
+
+        self._app.create_projects(names)
+        return self._server.json({'created': len(names)}, status=201)
+
+    def run(self, controllable=False):
+        return self._server.run(controllable)
@@ -0,0 +1,89 @@
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+
+from .load import run_load
+from .micro import run_micro
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent.parent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='benchmark', description='Measure the faces request path')
+    parser.add_argument('--projects', type=int, default=1000, help='projects seeded into the database')
+    parser.add_argument('--requests', type=int, default=2000, help='requests sent by the load test')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent load test clients')
+    parser.add_argument('--write-ratio', type=float, default=0.1, help='share of requests that PUT a project')
+    parser.add_argument('--development', action='store_true', help='load test the development server')
+    parser.add_argument('--skip-load', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--output', type=pathlib.Path, help='where to save the results (default: tmp/benchmarks/)')
+    parser.add_argument('--compare', type=pathlib.Path, help='earlier results to compare against')
+    args = parser.parse_args(argv)
+
+    results = {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'projects': args.projects,
+    }
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = pathlib.Path(scratch)
+        if not args.skip_micro:
+            results['micro'] = run_micro(ROOT_DIR, scratch / 'micro.db', scratch, args.projects)
+        if not args.skip_load:
+            results['load'] = run_load(
+                ROOT_DIR, scratch / 'load.db', args.projects, args.requests, args.concurrency, args.write_ratio,
+                production=not args.development,
+            )
+
+    output = args.output or pathlib.Path('tmp/benchmarks') / f'{results["started"].replace(":", "")}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    report(results, baseline)
+    print(f'Saved to {output}')
+
+
+def report(results, baseline=None):
+    for name, result in results.get('micro', {}).items():
+        before = _lookup(baseline, 'micro', name, 'seconds_per_op')
+        print(f'{name:<42}{result["seconds_per_op"] * 1e6:>12.1f} µs/op{_change(result["seconds_per_op"], before)}')
+        if 'peak_bytes' in result:
+            before = _lookup(baseline, 'micro', name, 'peak_bytes')
+            label = f'{name} peak memory'
+            print(f'{label:<42}{result["peak_bytes"] / 2**20:>12.1f} MiB{_change(result["peak_bytes"], before)}')
+
+    load = results.get('load')
+    if load:
+        before = _lookup(baseline, 'load', 'requests_per_second')
+        print(f'{"load requests/second":<42}{load["requests_per_second"]:>12.1f}{_change(load["requests_per_second"], before)}'
+              f'  ({load["requests"]} requests, {load["errors"]} errors)')
+        for kind, latency in load['latency'].items():
+            if latency['count']:
+                for p in ('p50', 'p99'):
+                    before = _lookup(baseline, 'load', 'latency', kind, p)
+                    label = f'load {kind} {p}'
+                    print(f'{label:<42}{latency[p] * 1e3:>12.2f} ms{_change(latency[p], before)}')
+
+
+def _lookup(results, *keys):
+    for key in keys:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def _change(value, before):
+    if not before:
+        return ''
+    return f'  {(value - before) / before:+.1%}'
+
+
+if __name__ == '__main__':
+    sys.exit(main())
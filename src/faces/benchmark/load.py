@@ -0,0 +1,131 @@
+import concurrent.futures
+import contextlib
+import http.client
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+from ..application import App, Web
+from ..infrastructure.http_server import HttpServer
+
+HOST, PORT = '127.0.0.1', 5000
+SEED_BATCH_SIZE = 1000
+
+
+def run_load(root_dir, database_path, projects=1000, requests=2000, concurrency=8, write_ratio=0.1, production=True):
+    with _environment(FACES_DATABASE_URI=f'sqlite+pysqlite:///{database_path}',
+                      FACES_PRODUCTION='1' if production else '0',
+                      FACES_THREADS=str(max(concurrency, 8))):
+        server = HttpServer.create()
+        web = Web(server, App.create(server.lifecycle), root_dir)
+        with _serving(web.run(controllable=True)):
+            _seed(projects)
+            return _drive(requests, concurrency, write_ratio)
+
+
+def _seed(projects):
+    names = [f'project-{i:08}' for i in range(projects)]
+    for start in range(0, len(names), SEED_BATCH_SIZE):
+        body = json.dumps(names[start:start + SEED_BATCH_SIZE])
+        status, _ = _request('POST', '/projects', body, {'Content-Type': 'application/json'})
+        if status != 201:
+            raise RuntimeError(f'Seeding failed with status {status}')
+
+
+def _drive(requests, concurrency, write_ratio):
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(worker_id)
+        samples = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return samples
+            if rng.random() < write_ratio:
+                kind, method, path = 'put', 'PUT', '/project'
+                body = urllib.parse.urlencode({'name': f'load-{worker_id}-{i}'})
+                headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            else:
+                kind, method, path, body, headers = 'get', 'GET', '/', None, {}
+            started = time.perf_counter()
+            status, _ = _request(method, path, body, headers)
+            samples.append((kind, status, time.perf_counter() - started))
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        samples = [sample for result in pool.map(worker, range(concurrency)) for sample in result]
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(samples),
+        'concurrency': concurrency,
+        'write_ratio': write_ratio,
+        'seconds': elapsed,
+        'requests_per_second': len(samples) / elapsed,
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'latency': {
+            'all': summarize([latency for _, _, latency in samples]),
+            'get': summarize([latency for kind, _, latency in samples if kind == 'get']),
+            'put': summarize([latency for kind, _, latency in samples if kind == 'put']),
+        },
+    }
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'p50': percentile(ordered, 50),
+        'p99': percentile(ordered, 99),
+        'max': ordered[-1],
+    }
+
+
+def percentile(ordered, p):
+    # Nearest-rank, so the result is always an observed latency
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def _request(method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection(HOST, PORT, timeout=30)
+    try:
+        connection.request(method, path, body, headers or {})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+@contextlib.contextmanager
+def _serving(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+@contextlib.contextmanager
+def _environment(**variables):
+    saved = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
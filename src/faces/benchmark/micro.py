@@ -0,0 +1,132 @@
+import timeit
+import tracemalloc
+
+import werkzeug
+import werkzeug.test
+
+from ..application import App, InMemoryRepository, Project, Repository, Web
+from ..infrastructure.database import Database
+from ..infrastructure.http_server import HttpServer
+from ..infrastructure.static_files import StaticFiles
+from ..infrastructure.templates import Templates
+
+
+ROUTE_COUNTS = (10, 100, 1000)
+LARGE_READ_ROWS = 100_000
+
+
+def run_micro(root_dir, database_path, cache_dir, projects=1000, repeat=5):
+    results = {
+        'repository_all_projects': _measure(_all_projects(database_path, projects), repeat),
+        'memory_repository_all_projects': _measure(_memory_all_projects(projects), repeat),
+        'template_render': _measure(_template_render(root_dir, cache_dir, projects), repeat),
+        'route_dispatch': _measure(_route_dispatch(root_dir), repeat),
+    }
+    large_read = _large_read(database_path.with_name('large_read.db'))
+    results[f'repository_read_{LARGE_READ_ROWS}_rows'] = {**_measure(large_read, repeat), **_peak_memory(large_read)}
+    for count in ROUTE_COUNTS:
+        last = count // 2 - 1
+        for kind, path in [('static', f'/static_{last}'), ('parameterised', f'/parameterised_{last}/7')]:
+            results[f'route_dispatch_{kind}_{count}_routes'] = _measure(_many_routes_dispatch(count, path), repeat)
+    return results
+
+
+def _all_projects(database_path, projects):
+    database = Database(f'sqlite+pysqlite:///{database_path}')
+    repository = Repository(database)
+    repository.initialize()
+    repository.save_projects([Project(f'project-{i:08}') for i in range(projects)])
+    database.commit()
+    return repository.all_projects
+
+
+def _large_read(database_path):
+    # Every row is read and touched the way the projects template does, without the cache
+    database = Database(f'sqlite+pysqlite:///{database_path}')
+    repository = Repository(database)
+    repository.initialize()
+    repository.save_projects([Project(f'project-{i:08}') for i in range(LARGE_READ_ROWS)])
+    database.commit()
+
+    def read():
+        for project in repository.all_projects():
+            project.name
+        database.rollback()
+    return read
+
+
+def _memory_all_projects(projects):
+    repository = InMemoryRepository([Project(f'project-{i:08}') for i in range(projects)])
+    return repository.all_projects
+
+
+def _template_render(root_dir, cache_dir, projects):
+    static_files = StaticFiles({'/static': root_dir / 'static'})
+    templates = Templates(root_dir / 'templates', production=True, cache_dir=str(cache_dir),
+                          globals={'static_url': static_files.url})
+    context = {'projects': [Project(f'project-{i:08}') for i in range(projects)]}
+    return lambda: templates.render('projects.jinja', context)
+
+
+def _route_dispatch(root_dir):
+    # The app's own route table, but every endpoint answers with a canned response,
+    # so only routing and the request wrapper are measured
+    recorder = _RouteRecorder()
+    Web(recorder, App.create_null(), root_dir)
+    response = werkzeug.Response('ok')
+    server = HttpServer()
+    server.configure(
+        routes=[(path, _canned(function.__name__, response), methods) for path, function, methods in recorder.routes],
+        statics=recorder.statics,
+        templates=recorder.templates,
+    )
+    app = server.wsgi_app()
+    environ = werkzeug.test.EnvironBuilder(path='/projects/search', query_string='q=p').get_environ()
+    return lambda: b''.join(app(environ, _ignore))
+
+
+def _many_routes_dispatch(count, path):
+    # Half the routes are plain paths and half have a placeholder; the last of each kind is requested
+    response = werkzeug.Response('ok')
+    routes = []
+    for i in range(count // 2):
+        routes.append((f'/static_{i}', _canned(f'static_{i}', response), ['GET']))
+        routes.append((f'/parameterised_{i}/<int:id>', _canned(f'parameterised_{i}', response), ['GET']))
+    server = HttpServer()
+    server.configure(routes, {}, '')
+    app = server.wsgi_app()
+    environ = werkzeug.test.EnvironBuilder(path=path).get_environ()
+    return lambda: b''.join(app(environ, _ignore))
+
+
+def _canned(name, response):
+    def endpoint(_request, **_values):
+        return response
+    endpoint.__name__ = name
+    return endpoint
+
+
+def _measure(operation, repeat):
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {'seconds_per_op': best, 'ops_per_second': 1 / best}
+
+
+def _peak_memory(operation):
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak}
+
+
+def _ignore(_status, _headers, _exc_info=None):
+    pass
+
+
+class _RouteRecorder:
+    def configure(self, routes, statics, templates, priorities=None, errors=None):
+        self.routes, self.statics, self.templates = routes, statics, templates
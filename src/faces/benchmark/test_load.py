@@ -0,0 +1,22 @@
+import pathlib
+
+from .load import percentile, run_load, summarize
+
+
+def test_percentiles_are_observed_latencies():
+    ordered = [0.1 * i for i in range(1, 11)]
+
+    assert percentile(ordered, 50) == ordered[4]
+    assert percentile(ordered, 99) == ordered[9]
+    assert summarize([]) == {'count': 0}
+    assert summarize([0.2, 0.1])['max'] == 0.2
+
+
+def test_drives_mixed_traffic_against_a_seeded_database(tmp_path):
+    root_dir = pathlib.Path(__file__).parent.parent.parent
+
+    results = run_load(root_dir, tmp_path / 'load.db', projects=5, requests=20, concurrency=2, write_ratio=0.5)
+
+    assert results['requests'] == 20
+    assert results['errors'] == 0
+    assert results['latency']['get']['count'] + results['latency']['put']['count'] == 20
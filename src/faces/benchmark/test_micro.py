@@ -0,0 +1,18 @@
+import pathlib
+
+from . import micro
+
+
+def test_measures_every_micro_benchmark(tmp_path, monkeypatch):
+    monkeypatch.setattr(micro, 'LARGE_READ_ROWS', 10)
+    monkeypatch.setattr(micro, 'ROUTE_COUNTS', (10,))
+    root_dir = pathlib.Path(__file__).parent.parent.parent
+
+    results = micro.run_micro(root_dir, tmp_path / 'micro.db', tmp_path, projects=5, repeat=1)
+
+    assert set(results) == {
+        'repository_all_projects', 'memory_repository_all_projects', 'template_render', 'route_dispatch',
+        'repository_read_10_rows', 'route_dispatch_static_10_routes', 'route_dispatch_parameterised_10_routes',
+    }
+    assert all(result['seconds_per_op'] > 0 for result in results.values())
+    assert results['repository_read_10_rows']['peak_bytes'] > 0
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+
+from .metrics import Metrics
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+
+class Admission:
+    # At most `limit` requests run at once; the rest wait, best priority first, in a queue of
+    # `queue_size`, and are turned away if it is full or they have waited `timeout` seconds
+    def __init__(self, limit, queue_size=64, timeout=1.0, metrics=None):
+        self._limit = limit
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._active = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+        self._metrics = metrics or Metrics()
+        self._metrics.describe('http_requests_queued_total', 'counter', 'Requests that waited for admission')
+        self._metrics.describe('http_requests_shed_total', 'counter', 'Requests turned away, by reason')
+        self._metrics.describe('http_admission_wait_seconds', 'histogram', 'Time spent waiting for admission')
+        self._metrics.add_collector(self._collect_metrics)
+
+    def enter(self, priority='normal', route='unmatched', waited=0.0):
+        labels = (('route', route),)
+        if waited >= self._timeout:
+            # Already queued too long before reaching us (e.g. behind the server's thread pool)
+            self._shed(route, 'timeout')
+            return False
+
+        with self._lock:
+            if self._active < self._limit and not self._waiting:
+                self._active += 1
+                return True
+            waiter = _Waiter(PRIORITIES[priority], next(self._sequence))
+            if len(self._waiting) >= self._queue_size:
+                worst = max(self._waiting)
+                if worst < waiter:
+                    self._shed(route, 'queue_full')
+                    return False
+                # A better-priority request takes the place of the worst one waiting
+                self._waiting.remove(worst)
+                heapq.heapify(self._waiting)
+                worst.evicted = True
+                worst.ready.set()
+            heapq.heappush(self._waiting, waiter)
+
+        self._metrics.increment('http_requests_queued_total', labels)
+        started = time.perf_counter()
+        waiter.ready.wait(self._timeout - waited)
+        self._metrics.observe('http_admission_wait_seconds', time.perf_counter() - started, labels)
+        with self._lock:
+            if waiter.admitted:
+                return True
+            if not waiter.evicted:
+                self._waiting.remove(waiter)
+                heapq.heapify(self._waiting)
+        self._shed(route, 'evicted' if waiter.evicted else 'timeout')
+        return False
+
+    def leave(self):
+        with self._lock:
+            if self._waiting:
+                # The slot passes straight to the best waiter, so a newcomer can't jump the queue
+                waiter = heapq.heappop(self._waiting)
+                waiter.admitted = True
+                waiter.ready.set()
+            else:
+                self._active -= 1
+
+    def _shed(self, route, reason):
+        self._metrics.increment('http_requests_shed_total', (('route', route), ('reason', reason)))
+
+    def _collect_metrics(self):
+        with self._lock:
+            active, waiting = self._active, len(self._waiting)
+        yield 'http_admission_active', 'gauge', 'Requests admitted and running', (), active
+        yield 'http_admission_waiting', 'gauge', 'Requests waiting for admission', (), waiting
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    ready: threading.Event = field(default_factory=threading.Event, compare=False)
+    admitted: bool = field(default=False, compare=False)
+    evicted: bool = field(default=False, compare=False)
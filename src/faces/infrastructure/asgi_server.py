@@ -0,0 +1,309 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import inspect
+import io
+import sys
+import time
+
+import werkzeug
+import werkzeug.exceptions
+
+from .compression import CompressionMiddleware
+from .events import OPENED
+from .http_server import HttpServer, _event_stream_response, _unavailable, server_settings
+
+# One event loop holds every connection, so idle ones (e.g. event streams) cost no thread. There is no
+# async database driver, though: endpoints, listeners and template rendering stay synchronous and run on
+# a pool of FACES_THREADS threads, which bounds how many requests do work at once. There are no worker
+# processes to fork or admit requests to, and lifespan startup already finishes before the socket accepts
+_UNSUPPORTED_SETTINGS = {'processes': 1, 'warm_start': False, 'admission': None}
+# Bytes gathered from a streamed body per trip to the pool, and per ASGI message
+_SEND_BUFFER = 8 * 1024
+
+
+class AsgiHttpServer(HttpServer):
+    cheap_event_streams = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._executor = concurrent.futures.ThreadPoolExecutor(self._threads, thread_name_prefix='faces-asgi')
+
+    @classmethod
+    def create(cls, startup=None):
+        settings = server_settings()
+        for name, default in _UNSUPPORTED_SETTINGS.items():
+            if settings.pop(name) != default:
+                print(f'FACES_SERVER=asgi ignores the {name} setting', file=sys.stderr)
+        return cls(startup=startup, **settings)
+
+    def run(self, controllable=False):
+        import uvicorn
+
+        close_event_streams = self._close_event_streams
+
+        class Server(uvicorn.Server):
+            def handle_exit(self, sig, frame):
+                # Event streams never finish by themselves, and uvicorn waits for open responses
+                close_event_streams()
+                super().handle_exit(sig, frame)
+
+        config = uvicorn.Config(self, host='127.0.0.1', port=5000, lifespan='on', log_level='warning')
+        server = Server(config)
+        if controllable:
+            return server
+        server.run()
+
+    def stream_events(self, hub):
+        subscription = hub.subscribe()
+        if subscription is None:
+            return _unavailable()
+        self._event_streams.add(subscription)
+
+        async def body():
+            try:
+                yield OPENED
+                async for message in subscription:
+                    yield message
+            finally:
+                subscription.close()
+                self._event_streams.discard(subscription)
+
+        return _event_stream_response(body())
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.lifecycle.start_async(_SyncRunner(self._executor, contextvars.copy_context()))
+                    self.startup.record('lifecycle start')
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        try:
+            await self._respond(scope, receive, send)
+        finally:
+            if self._first_request:
+                self._first_request = False
+                self._record_first_request(time.perf_counter() - started)
+
+    async def _respond(self, scope, receive, send):
+        environ = _environ(scope, await _read_body(receive))
+
+        if self._static_files.handles(environ):
+            run_sync = _SyncRunner(self._executor)
+            await _send_wsgi(send, *await run_sync(_call_wsgi, self._static_files.serve, environ))
+            return
+
+        started = time.perf_counter()
+        self.lifecycle.metrics.adjust('http_requests_in_flight', 1)
+        # Synchronous endpoints and listeners all run in one context, so that per-request
+        # state they keep in ContextVars (e.g. the database connection) carries between them
+        run_sync = _SyncRunner(self._executor, contextvars.copy_context())
+        try:
+            response = await self._dispatch_async(environ, run_sync)
+        except werkzeug.exceptions.HTTPException as e:
+            await self.lifecycle.request_failure_async(run_sync)
+            response = e.get_response(environ)
+        except Exception as error:
+            await self.lifecycle.request_failure_async(run_sync)
+            response = self._handle_error(environ, error)
+            if response is None:
+                self._observe(environ, 500, started)
+                raise
+        else:
+            if response.is_streamed:
+                try:
+                    await self._stream(response, environ, receive, send, run_sync)
+                finally:
+                    self._observe(environ, response.status_code, started)
+                return
+            try:
+                await self.lifecycle.request_success_async(run_sync)
+            except Exception as error:
+                response = self._handle_error(environ, error)
+                if response is None:
+                    self._observe(environ, 500, started)
+                    raise
+
+        self._observe(environ, response.status_code, started)
+        status, headers, body = _call_wsgi(self._compressed(response), environ)
+        await _send_wsgi(send, status, headers, body)
+
+    def _compressed(self, response):
+        if self._compression is None:
+            return response
+        return CompressionMiddleware(response, **self._compression)
+
+    async def _dispatch_async(self, environ, run_sync):
+        function, values = self._routes.match(environ)
+        request = werkzeug.Request(environ)
+        if inspect.iscoroutinefunction(function):
+            return await function(request, **values)
+        return await run_sync(function, request, **values)
+
+    async def _stream(self, response, environ, receive, send, run_sync):
+        # The request's transaction stays open until the last chunk has been produced
+        try:
+            if hasattr(response.response, '__aiter__'):
+                await send(_start_message(response.status, response.headers.to_wsgi_list()))
+                if not await _send_until_disconnected(response.response, receive, send):
+                    await self.lifecycle.request_failure_async(run_sync)
+                    return
+            else:
+                status, headers, app_iter = _start_wsgi(self._compressed(response), environ)
+                await send(_start_message(status, headers))
+                chunks = iter(app_iter)
+                while chunk := await run_sync(_next_batch, chunks):
+                    await send(_body_message(chunk))
+            await send({'type': 'http.response.body', 'body': b''})
+        except BaseException:
+            await self.lifecycle.request_failure_async(run_sync)
+            raise
+        else:
+            await self.lifecycle.request_success_async(run_sync)
+
+
+class _SyncRunner:
+    def __init__(self, executor, context=None):
+        self._executor = executor
+        self._context = context
+
+    def __call__(self, function, *args, **kwargs):
+        call = functools.partial(function, *args, **kwargs)
+        if self._context is not None:
+            call = functools.partial(self._context.run, call)
+        return asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+
+def _next_batch(chunks):
+    # Bodies come in small pieces; sending each on its own would cost a round trip and a message apiece
+    batch, size = [], 0
+    for chunk in chunks:
+        batch.append(chunk)
+        size += len(chunk)
+        if size >= _SEND_BUFFER:
+            break
+    return b''.join(batch)
+
+
+async def _send_until_disconnected(chunks, receive, send):
+    # An endless body (e.g. an event stream) is abandoned once the client goes away
+    sending = asyncio.ensure_future(_send_chunks(chunks, send))
+    disconnected = asyncio.ensure_future(_disconnect(receive))
+    try:
+        await asyncio.wait([sending, disconnected], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+    if sending.done():
+        sending.result()
+        return True
+    sending.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await sending
+    return False
+
+
+async def _send_chunks(chunks, send):
+    async for chunk in chunks:
+        await send(_body_message(chunk.encode() if isinstance(chunk, str) else chunk))
+
+
+async def _disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def _call_wsgi(app, environ):
+    status, headers, app_iter = _start_wsgi(app, environ)
+    try:
+        body = list(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return status, headers, body
+
+
+def _start_wsgi(app, environ):
+    # Responses and the compression middleware call start_response before returning their body
+    started = []
+
+    def start_response(status, headers, _exc_info=None):
+        started.append((status, headers))
+
+    app_iter = app(environ, start_response)
+    status, headers = started[0]
+    return status, headers, app_iter
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+def _environ(scope, body):
+    host, port = scope.get('server') or ('127.0.0.1', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ and key.startswith('HTTP_') else value
+    return environ
+
+
+async def _send_wsgi(send, status, headers, body):
+    await send(_start_message(status, headers))
+    await send({'type': 'http.response.body', 'body': b''.join(body)})
+
+
+def _start_message(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+
+def _body_message(chunk):
+    return {'type': 'http.response.body', 'body': chunk, 'more_body': True}
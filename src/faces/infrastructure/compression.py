@@ -0,0 +1,130 @@
+import zlib
+
+import werkzeug.datastructures
+import werkzeug.http
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MIMETYPES = frozenset([
+    'text/html', 'text/css', 'text/plain', 'text/csv',
+    'application/javascript', 'application/json', 'image/svg+xml',
+])
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=500, mimetypes=DEFAULT_MIMETYPES,
+                 gzip_level=6, brotli_quality=4, flush_size=16 * 1024):
+        self._app = app
+        self._minimum_size = minimum_size
+        self._mimetypes = mimetypes
+        self._gzip_level = gzip_level
+        self._brotli_quality = brotli_quality
+        self._flush_size = flush_size
+        self._encodings = ('br', 'gzip') if brotli else ('gzip',)
+
+    def __call__(self, environ, start_response):
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'), self._encodings)
+        if encoding is None or environ['REQUEST_METHOD'] == 'HEAD':
+            return self._app(environ, start_response)
+
+        compressors = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = werkzeug.datastructures.Headers(headers)
+            if self._should_compress(status, headers):
+                compressors.append(self._compressor(encoding))
+                headers['Content-Encoding'] = encoding
+                headers.remove('Content-Length')
+                _weaken_etag(headers)
+            if headers.get('Content-Type', '').split(';')[0] in self._mimetypes:
+                headers.add('Vary', 'Accept-Encoding')
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        return self._body(self._app(environ, compressing_start_response), compressors)
+
+    def _should_compress(self, status, headers):
+        if status[:3] in ('204', '304') or 'Content-Encoding' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        if headers.get('Content-Type', '').split(';')[0] not in self._mimetypes:
+            return False
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self._minimum_size
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliCompressor(self._brotli_quality)
+        return _GzipCompressor(self._gzip_level)
+
+    def _body(self, app_iter, compressors):
+        # start_response has always been called by the time the first chunk arrives
+        try:
+            compressor = None
+            pending = 0
+            for chunk in app_iter:
+                if compressor is None:
+                    if not compressors:
+                        yield chunk
+                        continue
+                    compressor = compressors[0]
+                output = compressor.compress(chunk)
+                pending += len(chunk)
+                # Flush regularly so that a streamed page keeps arriving as it is generated
+                if pending >= self._flush_size:
+                    output += compressor.flush()
+                    pending = 0
+                if output:
+                    yield output
+            if compressor is None and compressors:
+                compressor = compressors[0]
+            if compressor is not None:
+                yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def choose_encoding(accept_encoding, available):
+    accepted = werkzeug.http.parse_accept_header(accept_encoding)
+    for encoding in available:
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def _weaken_etag(headers):
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        headers['ETag'] = f'W/{etag}'
+
+
+class _GzipCompressor:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        return self._compressor.compress(chunk)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, chunk):
+        return self._compressor.process(chunk)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
@@ -1,61 +1,354 @@
+import queue
+import threading
+import functools
+import itertools
+import time
 from collections import namedtuple
 from contextvars import ContextVar
 
 import sqlalchemy
+import sqlalchemy.dialects.sqlite
+import sqlalchemy.event
 
-from .support import OutputTracker
+from .metrics import Metrics
+from .query_diagnostics import QueryDiagnostics
+from .support import OutputTracker, flag, setting
 
 
 class Database:
-    def __init__(self, uri, lifecycle=None, engine=sqlalchemy.create_engine):
-        self._engine = engine(uri, echo=True)
+    def __init__(self, uri, lifecycle=None, engine=sqlalchemy.create_engine,
+                 echo=False, pool=None, sqlite_pragmas=None, query_tracker=None, replica_uri=None,
+                 group_commit=None, diagnostics=None):
+        self._engine = engine(uri, echo=echo, **pool_arguments(uri, pool))
+        self._replica = engine(replica_uri, echo=echo, **pool_arguments(replica_uri, pool)) if replica_uri else None
         self._context_var = ContextVar('connection')
+        self._replica_var = ContextVar('replica_connection')
+        self._deferred_writes = ContextVar('deferred_writes', default=None)
+        self._statement_count = ContextVar('statement_count', default=0)
+        self._pool_stats = _PoolStats()
+
+        if sqlite_pragmas and isinstance(self._engine, sqlalchemy.Engine) \
+                and self._engine.dialect.name == 'sqlite':
+            sqlalchemy.event.listen(self._engine, 'connect', _SqlitePragmas(sqlite_pragmas))
 
         if lifecycle:
             lifecycle.add_request_listener(success=self.commit, failure=self.rollback)
 
-        self.query_tracker = OutputTracker()
+        self._metrics = lifecycle.metrics if lifecycle else Metrics()
+        self._metrics.describe('db_statement_duration_seconds', 'histogram', 'Time taken to execute a statement')
+        self._metrics.describe('db_statements_per_request', 'histogram', 'Statements executed in one transaction',
+                               buckets=(1, 2, 5, 10, 20, 50, 100))
+        self._metrics.add_collector(self._collect_pool_metrics)
+
+        self._diagnostics = diagnostics
+        self._writer = None
+        if group_commit is not None:
+            writer_engine = engine(uri, echo=echo, **pool_arguments(uri, pool))
+            if isinstance(writer_engine, sqlalchemy.Engine) and writer_engine.dialect.name == 'sqlite':
+                _take_over_sqlite_transactions(writer_engine, sqlite_pragmas)
+            self._writer = _GroupCommitWriter(writer_engine, self._metrics, **group_commit)
+
+        self.query_tracker = query_tracker or OutputTracker()
 
     @classmethod
     def create(cls, lifecycle):
-        return cls('sqlite+pysqlite:///faces.db', lifecycle)
+        diagnose = setting('query_diagnostics', False, flag)
+        return cls(
+            setting('database_uri', 'sqlite+pysqlite:///faces.db'),
+            lifecycle,
+            echo=setting('database_echo', False, flag),
+            pool=pool_settings(),
+            sqlite_pragmas={
+                'journal_mode': setting('sqlite_journal_mode', 'WAL'),
+                'synchronous': setting('sqlite_synchronous', 'NORMAL'),
+            },
+            query_tracker=OutputTracker.create(),
+            replica_uri=setting('database_replica_uri', None),
+            group_commit=group_commit_settings() if setting('database_group_commit', False, flag) else None,
+            diagnostics=QueryDiagnostics.create(lifecycle.metrics) if diagnose else None,
+        )
 
     @classmethod
-    def create_null(cls, **response_spec):
-        return cls('', engine=_StubEngine(response_spec))
+    def create_null(cls, tables=(), **response_spec):
+        return cls('', engine=_StubEngine(tables, response_spec))
 
     def execute(self, statement, parameters=None):
+        return self._execute(self._connection, statement, parameters)
+
+    def write(self, statement, parameters=None):
+        if self._writer is None:
+            return self.execute(statement, parameters)
+        # Held back until this context commits, then applied by the writer thread along with other contexts' writes
+        self.query_tracker.add(statement)
+        self._statement_count.set(self._statement_count.get() + 1)
+        writes = self._deferred_writes.get()
+        if writes is None:
+            writes = []
+            self._deferred_writes.set(writes)
+        writes.append((statement, parameters))
+
+    def read(self, statement, parameters=None):
+        # Once this context has touched the primary it keeps reading there, so it sees its own writes
+        if self._replica is None or self._maybe_connection():
+            return self.execute(statement, parameters)
+        return self._execute(self._replica_connection, statement, parameters)
+
+    def _execute(self, connection, statement, parameters):
         self.query_tracker.add(statement)
-        return self._connection().execute(statement, parameters)
+        c = connection()
+        started = time.perf_counter()
+        try:
+            return c.execute(statement, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            labels = (('statement', type(statement).__name__),)
+            self._metrics.observe('db_statement_duration_seconds', elapsed, labels)
+            self._statement_count.set(self._statement_count.get() + 1)
+            if self._diagnostics:
+                self._diagnostics.record(c, statement, elapsed)
+
+    @property
+    def dialect_name(self):
+        return self._engine.dialect.name
+
+    def has_table(self, name):
+        return self._engine.dialect.has_table(self._connection(), name)
 
     def commit(self):
+        writes = self._deferred_writes.get()
+        if writes:
+            self._deferred_writes.set(None)
+            try:
+                self._writer.apply(writes)
+            except Exception:
+                self.rollback()
+                raise
         self._finalize_connection(lambda c: c.commit())
 
     def rollback(self):
+        self._deferred_writes.set(None)
         self._finalize_connection(lambda c: c.rollback())
 
     def _finalize_connection(self, operation):
         c = self._maybe_connection()
-        if not c:
+        replica = self._replica_var.get(None)
+        if not c and not replica and not self._statement_count.get():
             return
-        operation(c)
-        c.close()
-        self._context_var.set(None)
+        if c:
+            operation(c)
+            c.close()
+            self._context_var.set(None)
+        if replica:
+            replica.rollback()
+            replica.close()
+            self._replica_var.set(None)
+        self._metrics.observe('db_statements_per_request', self._statement_count.get())
+        self._statement_count.set(0)
         self.query_tracker.end_batch()
+        if self._diagnostics:
+            self._diagnostics.end_batch()
+
+    def pool_stats(self):
+        return self._pool_stats.snapshot(getattr(self._engine, 'pool', None))
+
+    def _collect_pool_metrics(self):
+        stats = self.pool_stats()
+        yield 'db_pool_checkouts_total', 'counter', 'Connections checked out', (), stats['checkouts']
+        yield 'db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection', (), \
+            stats['wait_seconds_total']
+        if 'checked_out' in stats:
+            yield 'db_pool_checked_out', 'gauge', 'Connections currently checked out', (), stats['checked_out']
 
     def _connection(self):
         c = self._maybe_connection()
         if not c:
-            c = self._engine.connect()
+            c = self._connect(self._engine)
             self._context_var.set(c)
         return c
 
+    def _replica_connection(self):
+        c = self._replica_var.get(None)
+        if not c:
+            c = self._connect(self._replica)
+            self._replica_var.set(c)
+        return c
+
+    def _connect(self, engine):
+        started = time.perf_counter()
+        c = engine.connect()
+        self._pool_stats.record_checkout(time.perf_counter() - started)
+        return c
+
     def _maybe_connection(self):
         return self._context_var.get(None)
 
 
+def pool_settings():
+    return {
+        'pool_size': setting('pool_size', 5, int),
+        'max_overflow': setting('pool_max_overflow', 10, int),
+        'pool_timeout': setting('pool_timeout', 30.0, float),
+        # Unset means on, except for SQLite (see pool_arguments)
+        'pool_pre_ping': setting('pool_pre_ping', None, flag),
+        'pool_recycle': setting('pool_recycle', 3600, int),
+    }
+
+
+_QUEUE_POOL_ARGUMENTS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def pool_arguments(uri, pool):
+    # Sizing only applies to a queue pool; SQLite in memory gets another kind of pool, which rejects those arguments
+    if not pool:
+        return {}
+    url = sqlalchemy.engine.make_url(uri)
+    arguments = dict(pool)
+    if 'pool_pre_ping' in arguments and arguments['pool_pre_ping'] is None:
+        # A local SQLite file never drops a connection, so pinging it would only add a query to every request
+        arguments['pool_pre_ping'] = url.get_backend_name() != 'sqlite'
+    if issubclass(url.get_dialect().get_pool_class(url), sqlalchemy.pool.QueuePool):
+        return arguments
+    return {name: value for name, value in arguments.items() if name not in _QUEUE_POOL_ARGUMENTS}
+
+
+def group_commit_settings():
+    return {
+        'max_batch': setting('group_commit_max_batch', 64, int),
+        'max_wait': setting('group_commit_max_wait', 0.0, float),
+    }
+
+
+class _GroupCommitWriter:
+    def __init__(self, engine, metrics, max_batch=64, max_wait=0.0):
+        self._engine = engine
+        self._metrics = metrics
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        metrics.describe('db_group_commit_batch_size', 'histogram', 'Transactions applied in one group commit',
+                         buckets=(1, 2, 5, 10, 20, 50, 100))
+
+    def apply(self, writes):
+        pending = _PendingCommit(writes)
+        self._start()
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _start(self):
+        # Started on first use, so that it runs in each forked worker rather than the parent
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='faces-group-commit', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        with self._engine.connect() as connection:
+            while True:
+                self._commit(connection, self._next_batch())
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, connection, batch):
+        # One transaction and one sync to disk for the whole batch; a savepoint per request
+        # keeps one request's failure from undoing the others
+        try:
+            with connection.begin():
+                for pending in batch:
+                    savepoint = connection.begin_nested()
+                    try:
+                        for statement, parameters in pending.writes:
+                            connection.execute(statement, parameters)
+                    except Exception as e:
+                        savepoint.rollback()
+                        pending.error = e
+                    else:
+                        savepoint.commit()
+        except Exception as e:
+            for pending in batch:
+                if pending.error is None:
+                    pending.error = e
+        finally:
+            self._metrics.observe('db_group_commit_batch_size', len(batch))
+            for pending in batch:
+                pending.done.set()
+
+
+class _PendingCommit:
+    def __init__(self, writes):
+        self.writes = writes
+        self.done = threading.Event()
+        self.error = None
+
+
+def _take_over_sqlite_transactions(engine, pragmas):
+    # pysqlite's own transaction handling would let the first RELEASE SAVEPOINT commit;
+    # see "Serializable isolation / Savepoints / Transactional DDL" in the SQLAlchemy SQLite docs
+    def connect(dbapi_connection, connection_record):
+        if pragmas:
+            _SqlitePragmas(pragmas)(dbapi_connection, connection_record)
+        dbapi_connection.isolation_level = None
+
+    def begin(connection):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+    sqlalchemy.event.listen(engine, 'connect', connect)
+    sqlalchemy.event.listen(engine, 'begin', begin)
+
+
+class _SqlitePragmas:
+    def __init__(self, pragmas):
+        self._pragmas = pragmas
+
+    def __call__(self, dbapi_connection, _connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in self._pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+class _PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+    def snapshot(self, pool):
+        with self._lock:
+            stats = {
+                'checkouts': self._checkouts,
+                'wait_seconds_total': self._wait_total,
+                'wait_seconds_max': self._wait_max,
+            }
+        for name, attribute in [('size', 'size'), ('checked_out', 'checkedout'), ('overflow', 'overflow')]:
+            value = getattr(pool, attribute, None)
+            if callable(value):
+                stats[name] = value()
+        return stats
+
+
 class _StubEngine:
-    def __init__(self, response_spec):
+    def __init__(self, tables, response_spec):
+        self.dialect = _StubDialect(tables)
         self._response_spec = response_spec
 
     def __call__(self, _uri, **kwargs):
@@ -65,6 +358,15 @@ class _StubEngine:
         return _StubConnection(self._response_spec)
 
 
+class _StubDialect(sqlalchemy.dialects.sqlite.dialect):
+    def __init__(self, tables):
+        super().__init__()
+        self._tables = set(tables)
+
+    def has_table(self, connection, table_name, schema=None, **kw):
+        return table_name in self._tables
+
+
 class _StubConnection:
     def __init__(self, response_spec):
         self._response_spec = response_spec
@@ -88,12 +390,32 @@ class _StubConnection:
             assert False
 
         if response:
-            Record = namedtuple('Record', response[0])
-            return [Record(**row) for row in response]
-        return []
+            Record = _record_type(tuple(response[0]))
+            return _StubResult([Record(**row) for row in response])
+        return _StubResult([])
 
     def commit(self):
         pass
 
     def close(self):
         pass
+
+
+class _StubResult:
+    def __init__(self, rows):
+        self._rows = iter(rows)
+
+    def __iter__(self):
+        return self._rows
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+    def scalar(self):
+        row = next(self._rows, None)
+        return None if row is None else row[0]
+
+
+@functools.lru_cache(maxsize=64)
+def _record_type(fields):
+    return namedtuple('Record', fields)
@@ -0,0 +1,132 @@
+import asyncio
+import collections
+import threading
+
+from .support import setting
+
+KEEP_ALIVE = b': keep-alive\n\n'
+# Sent first, so that the response headers go out without waiting for an event
+OPENED = b': open\n\n'
+
+
+class EventHub:
+    def __init__(self, max_pending=64, max_subscribers=10_000, heartbeat=15.0):
+        self._max_pending = max_pending
+        self._max_subscribers = max_subscribers
+        self._heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @classmethod
+    def create(cls):
+        return cls(
+            max_pending=setting('event_queue', 64, int),
+            max_subscribers=setting('event_subscribers', 10_000, int),
+            heartbeat=setting('event_heartbeat', 15.0, float),
+        )
+
+    def subscribe(self):
+        with self._lock:
+            if len(self._subscribers) >= self._max_subscribers:
+                return None
+            subscription = Subscription(self, self._max_pending, self._heartbeat)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def publish(self, event, data):
+        # Encoded once, however many subscribers there are
+        message = encode(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if not subscription.offer(message):
+                self.dropped += 1
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _remove(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class Subscription:
+    def __init__(self, hub, max_pending, heartbeat):
+        self._hub = hub
+        self._max_pending = max_pending
+        self._heartbeat = heartbeat
+        self._pending = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._wake = None
+        self.closed = False
+
+    def offer(self, message):
+        with self._condition:
+            if self.closed:
+                return False
+            if len(self._pending) >= self._max_pending:
+                # A subscriber that can't keep up is disconnected rather than buffered without limit;
+                # the browser reconnects and reloads the list
+                self._close()
+                return False
+            self._pending.append(message)
+            self._condition.notify()
+            wake = self._wake
+        if wake:
+            wake()
+        return True
+
+    def close(self):
+        with self._condition:
+            self._close()
+            wake = self._wake
+        if wake:
+            wake()
+
+    def _close(self):
+        self.closed = True
+        self._condition.notify()
+        self._hub._remove(self)
+
+    def __iter__(self):
+        while True:
+            with self._condition:
+                if not self._pending and not self.closed:
+                    self._condition.wait(self._heartbeat)
+                message = self._next()
+            if message is None:
+                return
+            yield message
+
+    async def __aiter__(self):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        self._wake = lambda: loop.call_soon_threadsafe(ready.set)
+        while True:
+            ready.clear()
+            with self._condition:
+                waiting = not self._pending and not self.closed
+            if waiting:
+                try:
+                    await asyncio.wait_for(ready.wait(), self._heartbeat)
+                except asyncio.TimeoutError:
+                    pass
+            with self._condition:
+                message = self._next()
+            if message is None:
+                return
+            yield message
+
+    def _next(self):
+        if self._pending:
+            return self._pending.popleft()
+        if self.closed:
+            return None
+        return KEEP_ALIVE
+
+
+def encode(event, data):
+    lines = ''.join(f'data: {line}\n' for line in data.splitlines() or [''])
+    return f'event: {event}\n{lines}\n'.encode()
@@ -1,41 +1,88 @@
-from dataclasses import dataclass
+import json
+from dataclasses import dataclass, field
 
-import jinja2
+from .static_files import StaticFiles
+from .templates import Templates
 
 
 class FakeServer:
-    def configure(self, routes, statics, templates):
-        self._routes = routes
+    def configure(self, routes, statics, templates, priorities=None, errors=None):
+        self._errors = errors or {}
+        self._routes = {}
         self._path_lookup = {}
-        for path, endpoint, _methods in routes:
+        for path, endpoint, methods in routes:
             self._path_lookup[endpoint.__name__] = path
-        self._templates = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(templates),
-            autoescape=True
-        )
+            for method in methods:
+                self._routes[(method, path)] = endpoint
+        self._templates = Templates(templates, globals={'static_url': StaticFiles(statics).url})
 
-    def run(self):
+    def run(self, controllable=False):
         pass
 
-    def render(self, template, **context):
-        return self._templates.get_template(f'{template}.jinja').render(context)
+    def render(self, template, stream=False, etag=None, block=None, status=200, headers=None, **context):
+        name = f'{template}.jinja'
+        if stream:
+            body = ''.join(self._templates.generate(name, context, block=block))
+        else:
+            body = self._templates.render(name, context, block=block)
+        return body if status == 200 else (status, body)
+
+    def render_block(self, template, block, **context):
+        return self._templates.render(f'{template}.jinja', context, block=block)
+
+    def stream_events(self, hub):
+        subscription = hub.subscribe()
+        if subscription is None:
+            return 503, ''
+        return 200, subscription
+
+    def is_partial(self, request):
+        return request.headers.get('HX-Request') == 'true'
+
+    def not_modified(self, request, etag):
+        if request.headers.get('If-None-Match') == f'"{etag}"':
+            return 304, ''
+        return None
+
+    def json(self, data, status=200):
+        return status, data
 
     def redirect(self, endpoint):
         return 303, self._path_lookup[endpoint]
 
-    def get(self, path):
-        for a_path, endpoint, methods in self._routes:
-            if a_path == path and 'GET' in methods:
-                return 200, endpoint(None)
-        return 404, ''
+    def get(self, path, args=None, headers=None):
+        return self._call('GET', path, FakeRequest(args=args or {}, headers=headers or {}))
 
-    def put(self, path, form):
-        for a_path, endpoint, methods in self._routes:
-            if a_path == path and 'PUT' in methods:
-                return endpoint(FakeRequest(form=form))
-        return 404, ''
+    def put(self, path, form, headers=None):
+        return self._call('PUT', path, FakeRequest(form=form, headers=headers or {}))
+
+    def post(self, path, data, mimetype):
+        return self._call('POST', path, FakeRequest(data=data, mimetype=mimetype))
+
+    def _call(self, method, path, request):
+        endpoint = self._routes.get((method, path))
+        if endpoint is None:
+            return 404, ''
+        try:
+            result = endpoint(request)
+        except Exception as error:
+            handler = next((h for error_type, h in self._errors.items() if isinstance(error, error_type)), None)
+            if handler is None:
+                raise
+            result = handler(request, error)
+        return result if isinstance(result, tuple) else (200, result)
 
 
 @dataclass
 class FakeRequest:
-    form: dict
+    form: dict = field(default_factory=dict)
+    args: dict = field(default_factory=dict)
+    headers: dict = field(default_factory=dict)
+    data: str = ''
+    mimetype: str = ''
+
+    def get_data(self, as_text=False):
+        return self.data if as_text else self.data.encode()
+
+    def get_json(self):
+        return json.loads(self.data)
@@ -1,77 +1,522 @@
+import concurrent.futures
+import inspect
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from contextvars import ContextVar
 from dataclasses import dataclass
 from typing import Callable
 
-import jinja2
 import werkzeug
-import werkzeug.debug
-import werkzeug.middleware.shared_data
 import werkzeug.routing
 import werkzeug.serving
 import werkzeug.utils
 
+from .support import StartupReport, flag, setting
+from .admission import Admission
+from .compression import CompressionMiddleware
+from .events import OPENED
+from .metrics import Metrics
+from .static_files import StaticFiles
+from .templates import Templates
+
 
 class HttpServer:
-    def __init__(self):
+    # Each open event stream holds one of the server's threads
+    cheap_event_streams = False
+
+    def __init__(self, production=False, processes=1, threads=8, template_cache_dir=None, static_cache_dir=None,
+                 metrics_route=False, compression=None, warm_start=False, startup=None, admission=None):
         self.lifecycle = Lifecycle()
+        self.startup = startup or StartupReport()
+        self._warm_start = warm_start
+        self._warm = threading.Event()
+        self._warm.set()
+        self._warm_up_failed = False
+        self._first_request = True
+        self._compression = compression
+        self._production = production
+        self._processes = processes
+        self._threads = threads
+        self._template_cache_dir = template_cache_dir
+        self._static_cache_dir = static_cache_dir
+        self._metrics_route = metrics_route
+        # Each event stream holds one of the production pool's threads, so they may take only half of them
+        self._stream_slots = threading.BoundedSemaphore(max(1, threads // 2)) if production else None
+        self._event_streams = set()
+        self._admission = Admission(**admission, metrics=self.lifecycle.metrics) if admission else None
+        self._admitted = ContextVar('admitted', default=False)
+        self._priorities = {}
+        self._errors = {}
+
+        metrics = self.lifecycle.metrics
+        metrics.describe('http_request_duration_seconds', 'histogram', 'Time taken to produce a response')
+        metrics.describe('http_responses_total', 'counter', 'Responses sent, by route and status')
+        metrics.describe('http_requests_in_flight', 'gauge', 'Requests currently being handled')
+        metrics.add_collector(self._collect_template_metrics)
+        metrics.add_collector(self._collect_startup_metrics)
 
     @classmethod
-    def create(cls):
-        return cls()
-
-    def configure(self, routes, statics, templates):
-        rules, self._functions = _convert_routes(routes)
-        self._map = werkzeug.routing.Map(rules)
-        self._urls = self._map.bind('127.0.0.1')
-        self._templates = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(templates),
-            autoescape=True
+    def create(cls, startup=None):
+        return cls(startup=startup, **server_settings())
+
+    @property
+    def processes(self):
+        # Development always runs a single process
+        return self._processes if self._production else 1
+
+    def configure(self, routes, statics, templates, priorities=None, errors=None):
+        self._priorities = priorities or {}
+        self._errors = errors or {}
+        if self._metrics_route:
+            routes = [*routes, ('/metrics', self.on_metrics, ['GET'])]
+        self._routes = _RouteTable(*_convert_routes(routes))
+        self._urls = self._routes.urls
+        self._static_files = StaticFiles(statics, fingerprint=self._production, compress=self._production,
+                                         cache_dir=self._static_cache_dir, reload=not self._production)
+        self._templates = Templates(
+            templates, self._production, self._template_cache_dir,
+            globals={'static_url': self._static_files.url},
+            precompile=self._production and not self._warm_start,
         )
-        self._statics = statics
 
-    def render(self, template, **context):
-        t = self._templates.get_template(f'{template}.jinja')
-        return werkzeug.Response(t.render(context), mimetype='text/html')
+    def render(self, template, stream=False, etag=None, block=None, status=200, headers=None, **context):
+        name = f'{template}.jinja'
+        if stream:
+            body = self._templates.generate(name, context, block=block)
+        else:
+            body = self._templates.render(name, context, block=block)
+        response = werkzeug.Response(body, status=status, headers=headers, mimetype='text/html')
+        if etag:
+            response.set_etag(self._versioned_etag(etag))
+            response.cache_control.no_cache = True
+        return response
+
+    def render_block(self, template, block, **context):
+        return self._templates.render(f'{template}.jinja', context, block=block)
+
+    def template_render_times(self):
+        return self._templates.render_times()
+
+    def _collect_template_metrics(self):
+        templates = getattr(self, '_templates', None)
+        if templates is None:
+            return
+        for name, timing in templates.render_times().items():
+            labels = (('template', name),)
+            yield 'template_renders_total', 'counter', 'Templates rendered', labels, timing['count']
+            yield 'template_render_seconds_total', 'counter', 'Time spent rendering', labels, timing['seconds_total']
+
+    def stream_events(self, hub):
+        if self._stream_slots and not self._stream_slots.acquire(blocking=False):
+            return _unavailable()
+        subscription = hub.subscribe()
+        if subscription is None:
+            if self._stream_slots:
+                self._stream_slots.release()
+            return _unavailable()
+        self._event_streams.add(subscription)
+        # A stream lives until the client goes away; it is bounded by its own slots, not by admission
+        self._leave_admission()
+
+        def body():
+            try:
+                yield OPENED
+                yield from subscription
+            finally:
+                subscription.close()
+                self._event_streams.discard(subscription)
+                if self._stream_slots:
+                    self._stream_slots.release()
+
+        return _event_stream_response(body())
+
+    def _close_event_streams(self):
+        for subscription in list(self._event_streams):
+            subscription.close()
+
+    def is_partial(self, request):
+        return request.headers.get('HX-Request') == 'true'
+
+    def not_modified(self, request, etag):
+        etag = self._versioned_etag(etag)
+        if not request.if_none_match.contains_weak(etag):
+            return None
+        response = werkzeug.Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    def _versioned_etag(self, etag):
+        # Pages embed the templates and the hashed static URLs, so a deploy that changes either must not
+        # leave browsers revalidating to the old HTML
+        return f'{etag}-{self._templates.digest()}{self._static_files.digest()}'
+
+    def json(self, data, status=200):
+        return werkzeug.Response(json.dumps(data), status=status, mimetype='application/json')
 
     def redirect(self, endpoint):
         return werkzeug.utils.redirect(self._urls.build(endpoint), 303)
 
+    def wsgi_app(self):
+        app = self._app
+        if self._compression is not None:
+            app = CompressionMiddleware(app, **self._compression)
+        return self._static_files.wrap(app)
+
     def run(self, controllable=False):
         host, port = '127.0.0.1', 5000
+        app = self.wsgi_app()
 
-        app = self._app
-        for url_path, file_path in self._statics.items():
-            app = werkzeug.middleware.shared_data.SharedDataMiddleware(
-                app, {url_path: str(file_path)}
-            )
+        if self._production:
+            return self._run_production(host, port, app, controllable)
 
-        self.lifecycle.start()
+        self._warm_up()
 
+        import werkzeug.debug  # only needed in development
         if controllable:
-            return werkzeug.serving.make_server(host, port, werkzeug.debug.DebuggedApplication(app))
+            return werkzeug.serving.make_server(host, port, werkzeug.debug.DebuggedApplication(app), threaded=True)
         else:
+            # Threaded, so that a page's open event stream doesn't hold up its other requests
             werkzeug.run_simple(
                 host, port,
                 app,
-                use_debugger=True, use_reloader=True
+                use_debugger=True, use_reloader=True, threaded=True
             )
 
+    def _run_production(self, host, port, app, controllable):
+        if controllable:
+            server = _PooledServer(host, port, app, self._threads, before_drain=self._close_event_streams)
+            self._start(server)
+            return server
+
+        listener = socket.create_server((host, port), backlog=1024)
+
+        def serve(ready):
+            server = _PooledServer(host, port, app, self._threads, fd=listener.fileno(),
+                                   before_drain=self._close_event_streams)
+            self._start(server, ready)
+            _serve_until_terminated(server)
+
+        try:
+            _Supervisor(self._processes, serve).run()
+        finally:
+            listener.close()
+
+    def _start(self, server, ready=None):
+        if not self._warm_start:
+            self._warm_up()
+            if ready:
+                ready()
+            return
+
+        # The server is already accepting; requests wait in _app until warm-up is done
+        self._warm.clear()
+
+        def warm_up():
+            try:
+                self._warm_up()
+            except Exception:
+                traceback.print_exc()
+                self._warm_up_failed = True
+                self._warm.set()
+                server.shutdown()
+            finally:
+                if ready:
+                    ready()
+
+        threading.Thread(target=warm_up, name='faces-warm-up', daemon=True).start()
+
+    def _warm_up(self):
+        self.lifecycle.start()
+        if self._production and self._warm_start:
+            self._templates.precompile()
+        self.startup.record('lifecycle start')
+        self._warm.set()
+
     def _app(self, environ, start_response):
-        request = werkzeug.Request(environ)
+        if not self._warm.is_set():
+            self._warm.wait()
+        if self._warm_up_failed:
+            return _unavailable('Starting up failed')(environ, start_response)
+        started = time.perf_counter()
+        self.lifecycle.metrics.adjust('http_requests_in_flight', 1)
         try:
-            response = self._dispatch(request)
+            response = self._dispatch(environ)
         except werkzeug.exceptions.HTTPException as e:
             self.lifecycle.request_failure()
             response = e
-        except Exception:
+        except Exception as error:
+            self.lifecycle.request_failure()
+            response = self._handle_error(environ, error)
+            if response is None:
+                self._observe(environ, 500, started)
+                raise
+        else:
+            if response.is_streamed:
+                body = response(environ, start_response)
+                return self._finish_after_streaming(environ, response.status_code, started, body)
+            try:
+                self.lifecycle.request_success()
+            except Exception as error:
+                response = self._handle_error(environ, error)
+                if response is None:
+                    self._observe(environ, 500, started)
+                    raise
+        self._observe(environ, getattr(response, 'status_code', None) or response.code, started)
+        return response(environ, start_response)
+
+    def _handle_error(self, environ, error):
+        # Errors the application expects (e.g. a failed constraint, which may only surface at commit)
+        # get the response it asked for; anything else is a 500
+        for error_type, handler in self._errors.items():
+            if isinstance(error, error_type):
+                return handler(werkzeug.Request(environ), error)
+        return None
+
+    def _finish_after_streaming(self, environ, status, started, body):
+        # The request's transaction stays open until the last chunk has been produced
+        try:
+            yield from body
+        except BaseException:
             self.lifecycle.request_failure()
             raise
         else:
             self.lifecycle.request_success()
-        return response(environ, start_response)
+        finally:
+            self._observe(environ, status, started)
+
+    def _observe(self, environ, status, started):
+        metrics = self.lifecycle.metrics
+        labels = (('route', environ.get('faces.route', 'unmatched')), ('method', environ['REQUEST_METHOD']))
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started, labels)
+        metrics.increment('http_responses_total', labels + (('status', str(status)),))
+        metrics.adjust('http_requests_in_flight', -1)
+        self._leave_admission()
+        if self._first_request:
+            self._first_request = False
+            self._record_first_request(time.perf_counter() - started)
+
+    def _record_first_request(self, seconds):
+        if self.startup.record('first request', seconds) and setting('startup_report', False, flag):
+            print(self.startup, file=sys.stderr, flush=True)
+
+    def _collect_startup_metrics(self):
+        for phase, seconds in self.startup.phases().items():
+            yield 'startup_phase_seconds', 'gauge', 'Time taken by each phase of startup', (('phase', phase),), seconds
+
+    def on_metrics(self, _request):
+        return werkzeug.Response(self.lifecycle.metrics.render(), content_type=_PROMETHEUS_CONTENT_TYPE)
+
+    def _dispatch(self, environ):
+        # Unroutable requests are answered before a Request is built
+        function, values = self._routes.match(environ)
+        if self._admission:
+            self._admit(environ)
+        return function(werkzeug.Request(environ), **values)
+
+    def _admit(self, environ):
+        route = environ['faces.route']
+        method = environ['REQUEST_METHOD']
+        priority = self._priorities.get(route) or ('high' if method in ('GET', 'HEAD') else 'normal')
+        accepted = _accepted_at.get()
+        # Only the first request on a kept-alive connection waited for a worker
+        _accepted_at.set(None)
+        waited = time.perf_counter() - accepted if accepted else 0.0
+        if not self._admission.enter(priority, route, waited):
+            raise werkzeug.exceptions.ServiceUnavailable('The server is too busy, try again shortly', retry_after=1)
+        self._admitted.set(True)
+
+    def _leave_admission(self):
+        if self._admitted.get():
+            self._admitted.set(False)
+            self._admission.leave()
+
+
+# When the pool accepted the connection, so time spent waiting for a worker counts against admission
+_accepted_at = ContextVar('accepted_at', default=None)
+
+
+class _QuietRequestHandler(werkzeug.serving.WSGIRequestHandler):
+    timeout = 30
 
-    def _dispatch(self, request):
-        endpoint, values = self._map.bind_to_environ(request).match()
-        return self._functions[endpoint](request, **values)
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class _PooledServer(werkzeug.serving.BaseWSGIServer):
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None, before_drain=None):
+        self._pool = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='faces-worker')
+        self._before_drain = before_drain
+        super().__init__(host, port, app, handler=_QuietRequestHandler, fd=fd)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request_in_worker, request, client_address, time.perf_counter())
+
+    def _process_request_in_worker(self, request, client_address, accepted):
+        _accepted_at.set(accepted)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def serve_forever(self, poll_interval=0.5):
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            if self._before_drain:
+                self._before_drain()
+            self._pool.shutdown(wait=True)
+
+
+def _serve_until_terminated(server):
+    def terminate(_signum, _frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class _Supervisor:
+    def __init__(self, processes, serve, max_start_failures=5, backoff=0.5, max_backoff=10.0):
+        self._processes = processes
+        self._serve = serve
+        self._max_start_failures = max_start_failures
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._start_failures = 0
+        self._workers = set()
+        self._stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        for _ in range(self._processes):
+            self._start_worker()
+
+        while self._workers:
+            try:
+                pid, _status = os.wait()
+            except ChildProcessError:
+                break
+            self._workers.discard(pid)
+            if not self._stopping:
+                self._start_worker()
+
+    def _start_worker(self):
+        while not self._stopping:
+            pid, ready = self._spawn()
+            if ready:
+                self._start_failures = 0
+                self._workers.add(pid)
+                return
+
+            # The worker died before it was ready (e.g. the database is unreachable); retrying at once
+            # would only fail the same way, so back off and give up if it keeps happening
+            os.waitpid(pid, 0)
+            self._start_failures += 1
+            if self._start_failures >= self._max_start_failures:
+                self._stop(None, None)
+                for worker in self._workers:
+                    os.waitpid(worker, 0)
+                raise SystemExit(f'Workers failed to start {self._start_failures} times in a row; giving up')
+            time.sleep(min(self._backoff * 2 ** (self._start_failures - 1), self._max_backoff))
+
+    def _spawn(self):
+        # Workers start one at a time so that start listeners never race each other
+        ready_reader, ready_writer = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(ready_writer)
+            ready = os.read(ready_reader, 1) == b'.'
+            os.close(ready_reader)
+            return pid, ready
+
+        os.close(ready_reader)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        def ready():
+            os.write(ready_writer, b'.')
+            os.close(ready_writer)
+
+        try:
+            self._serve(ready)
+        except BaseException:
+            traceback.print_exc()
+            os._exit(1)
+        os._exit(0)
+
+    def _stop(self, _signum, _frame):
+        self._stopping = True
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def server_settings():
+    return {
+        'production': setting('production', False, flag),
+        'processes': setting('processes', 1, int),
+        'threads': setting('threads', 8, int),
+        'template_cache_dir': setting('template_cache_dir', None),
+        'static_cache_dir': setting('static_cache_dir', None),
+        'metrics_route': setting('metrics', False, flag),
+        'compression': _compression_settings() if setting('compression', True, flag) else None,
+        'warm_start': setting('warm_start', False, flag),
+        'admission': _admission_settings(),
+    }
+
+
+def _admission_settings():
+    limit = setting('admission_limit', 0, int)
+    if limit <= 0:
+        return None
+    return {
+        'limit': limit,
+        'queue_size': setting('admission_queue', 64, int),
+        'timeout': setting('admission_timeout', 1.0, float),
+    }
+
+
+def _compression_settings():
+    options = {'minimum_size': setting('compression_minimum_size', 500, int)}
+    mimetypes = setting('compression_mimetypes', None)
+    if mimetypes:
+        options['mimetypes'] = frozenset(m.strip() for m in mimetypes.split(','))
+    return options
+
+
+_PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _event_stream_response(body):
+    response = werkzeug.Response(body, mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _unavailable(message='Too many event streams'):
+    response = werkzeug.Response(message, status=503)
+    response.headers['Retry-After'] = '5'
+    return response
 
 
 def _convert_routes(routes):
@@ -90,10 +535,55 @@ def _convert_routes(routes):
     return rules, functions
 
 
+class _RouteTable:
+    def __init__(self, rules, functions):
+        whole_map = werkzeug.routing.Map(rules)
+        self.urls = whole_map.bind('127.0.0.1')
+        self._functions = functions
+
+        # Paths without placeholders are looked up directly; only the rest go through werkzeug's matcher
+        self._static = {}
+        self._allowed = {}
+        parameterised = []
+        for rule in whole_map.iter_rules():
+            if rule.arguments:
+                parameterised.append(rule.empty())
+                continue
+            for method in rule.methods:
+                self._static[(method, rule.rule)] = (rule.endpoint, functions[rule.endpoint])
+            self._allowed.setdefault(rule.rule, set()).update(rule.methods)
+        self._matcher = werkzeug.routing.Map(parameterised) if parameterised else None
+
+    def match(self, environ):
+        path = environ.get('PATH_INFO') or '/'
+        found = self._static.get((environ['REQUEST_METHOD'], path))
+        if found:
+            endpoint, function = found
+            values = {}
+        else:
+            endpoint, values = self._match_parameterised(environ, path)
+            function = self._functions[endpoint]
+        environ['faces.route'] = endpoint
+        return function, values
+
+    def _match_parameterised(self, environ, path):
+        allowed = self._allowed.get(path, set())
+        try:
+            if self._matcher is None:
+                raise werkzeug.exceptions.NotFound()
+            return self._matcher.bind_to_environ(environ).match()
+        except (werkzeug.exceptions.NotFound, werkzeug.exceptions.MethodNotAllowed) as e:
+            allowed = allowed.union(getattr(e, 'valid_methods', None) or ())
+            if allowed:
+                raise werkzeug.exceptions.MethodNotAllowed(sorted(allowed)) from None
+            raise
+
+
 class Lifecycle:
-    def __init__(self):
+    def __init__(self, metrics=None):
         self._start_listeners = []
         self._request_listeners = []
+        self.metrics = metrics or Metrics()
 
     def add_start_listener(self, listener):
         self._start_listeners.append(listener)
@@ -106,13 +596,41 @@ class Lifecycle:
             l()
 
     def request_success(self):
-        for l in self._request_listeners:
-            l.success()
+        for i, l in enumerate(self._request_listeners):
+            try:
+                l.success()
+            except Exception:
+                # e.g. a failed commit: the listeners that haven't heard yet see a failed request
+                for remaining in self._request_listeners[i + 1:]:
+                    remaining.failure()
+                raise
 
     def request_failure(self):
         for l in self._request_listeners:
             l.failure()
 
+    async def start_async(self, run_sync):
+        await _notify_async(self._start_listeners, run_sync)
+
+    async def request_success_async(self, run_sync):
+        for i, l in enumerate(self._request_listeners):
+            try:
+                await _notify_async([l.success], run_sync)
+            except Exception:
+                await _notify_async([remaining.failure for remaining in self._request_listeners[i + 1:]], run_sync)
+                raise
+
+    async def request_failure_async(self, run_sync):
+        await _notify_async([l.failure for l in self._request_listeners], run_sync)
+
+
+async def _notify_async(listeners, run_sync):
+    for listener in listeners:
+        if inspect.iscoroutinefunction(listener):
+            await listener()
+        else:
+            await run_sync(listener)
+
 
 @dataclass
 class _RequestListener:
@@ -0,0 +1,103 @@
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help, buckets=DEFAULT_BUCKETS):
+        self._descriptions[name] = (kind, help, buckets)
+
+    def increment(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def adjust(self, name, amount, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        buckets = self._descriptions[name][2]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(buckets))
+            histogram.observe(bisect.bisect_left(buckets, value), value)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def value(self, name, labels=()):
+        with self._lock:
+            key = (name, labels)
+            if key in self._counters:
+                return self._counters[key]
+            if key in self._gauges:
+                return self._gauges[key]
+            histogram = self._histograms.get(key)
+            return histogram.count if histogram else None
+
+    def render(self):
+        with self._lock:
+            samples = {}
+            for (name, labels), value in list(self._counters.items()) + list(self._gauges.items()):
+                samples.setdefault(name, []).append((name, labels, value))
+            for (name, labels), histogram in self._histograms.items():
+                samples.setdefault(name, []).extend(histogram.samples(name, labels, self._descriptions[name][2]))
+
+        for collector in self._collectors:
+            for name, kind, help, labels, value in collector():
+                self._descriptions.setdefault(name, (kind, help, None))
+                samples.setdefault(name, []).append((name, labels, value))
+
+        lines = []
+        for name in sorted(samples):
+            kind, help, _buckets = self._descriptions.get(name, ('untyped', name, None))
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples[name]:
+                lines.append(f'{sample_name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _Histogram:
+    def __init__(self, size):
+        self.counts = [0] * (size + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, bucket, value):
+        self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels, buckets):
+        cumulative = 0
+        for bound, count in zip(buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket', labels + (('le', le),), cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, self.count
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from typing import Callable
+
+import sqlalchemy
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    apply: Callable
+
+
+class Migrator:
+    def __init__(self, database, migrations, table_name='schema_migrations'):
+        self._database = database
+        self._migrations = sorted(migrations, key=lambda m: m.version)
+        self._table = sqlalchemy.Table(
+            table_name, sqlalchemy.MetaData(),
+            sqlalchemy.Column('version', sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column('name', sqlalchemy.Text, nullable=False),
+        )
+
+    def current_version(self):
+        result = self._database.execute(sqlalchemy.select(sqlalchemy.func.max(self._table.c.version)))
+        return result.scalar() or 0
+
+    def run(self):
+        self._database.execute(sqlalchemy.schema.CreateTable(self._table, if_not_exists=True))
+        self._database.commit()
+
+        current = self.current_version()
+        for migration in self._migrations:
+            if migration.version <= current:
+                continue
+            try:
+                migration.apply(self._database)
+                self._database.execute(
+                    sqlalchemy.insert(self._table).values(version=migration.version, name=migration.name)
+                )
+            except Exception:
+                self._database.rollback()
+                raise
+            self._database.commit()
@@ -0,0 +1,112 @@
+import collections
+import json
+import logging
+import threading
+from contextvars import ContextVar
+
+import sqlalchemy
+import sqlalchemy.exc
+
+from .metrics import Metrics
+from .support import setting
+
+_MAX_EXPLAINED_SHAPES = 1024
+
+
+class QueryDiagnostics:
+    def __init__(self, max_statements=20, max_seconds=0.25, slow_seconds=0.05, repeated_statements=5,
+                 log=None, metrics=None):
+        self._max_statements = max_statements
+        self._max_seconds = max_seconds
+        self._slow_seconds = slow_seconds
+        self._repeated_statements = repeated_statements
+        self._log = log or logging.getLogger('faces.queries')
+        self._metrics = metrics or Metrics()
+        self._metrics.describe('db_query_diagnostics_total', 'counter', 'Query problems found, by kind')
+        self._statements = ContextVar('diagnosed_statements', default=None)
+        self._explained = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, metrics=None):
+        return cls(
+            max_statements=setting('query_budget_statements', 20, int),
+            max_seconds=setting('query_budget_seconds', 0.25, float),
+            slow_seconds=setting('slow_query_seconds', 0.05, float),
+            repeated_statements=setting('repeated_query_threshold', 5, int),
+            metrics=metrics,
+        )
+
+    def record(self, connection, statement, seconds):
+        sql = _shape(connection, statement)
+        statements = self._statements.get()
+        if statements is None:
+            statements = []
+            self._statements.set(statements)
+        statements.append((sql, seconds))
+
+        plan = self._explain_new_shape(connection, statement, sql)
+        if seconds >= self._slow_seconds:
+            self._report('slow_statement', sql=sql, seconds=round(seconds, 6),
+                         plan=plan or _explain(connection, statement))
+
+    def end_batch(self):
+        statements = self._statements.get()
+        self._statements.set(None)
+        if not statements:
+            return
+
+        total = sum(seconds for _, seconds in statements)
+        if len(statements) > self._max_statements or total > self._max_seconds:
+            self._report('query_budget_exceeded', statements=len(statements), seconds=round(total, 6),
+                         max_statements=self._max_statements, max_seconds=self._max_seconds)
+
+        # The same statement shape over and over in one request is usually a query in a loop (N+1)
+        for sql, count in collections.Counter(sql for sql, _ in statements).items():
+            if count >= self._repeated_statements:
+                self._report('repeated_statement', sql=sql, count=count)
+
+    def _explain_new_shape(self, connection, statement, sql):
+        # Each shape is explained once per process, so scans are caught the first time a query runs
+        with self._lock:
+            if sql in self._explained or len(self._explained) >= _MAX_EXPLAINED_SHAPES:
+                return self._explained.get(sql)
+            self._explained[sql] = None
+        plan = _explain(connection, statement)
+        with self._lock:
+            self._explained[sql] = plan
+        scanned = _scanned_tables(plan)
+        if scanned:
+            self._report('full_scan', sql=sql, tables=scanned, plan=plan)
+        return plan
+
+    def _report(self, kind, **details):
+        self._metrics.increment('db_query_diagnostics_total', (('kind', kind),))
+        self._log.warning(json.dumps({'event': kind, **details}))
+
+
+def _shape(connection, statement):
+    # Bound parameters stay as placeholders, so repeats of one query share a shape
+    return str(statement.compile(dialect=connection.dialect))
+
+
+def _explain(connection, statement):
+    if connection.dialect.name != 'sqlite' or not isinstance(statement, sqlalchemy.Select):
+        return None
+    try:
+        sql = statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')
+        return [row.detail for row in rows]
+    except sqlalchemy.exc.SQLAlchemyError:
+        return None
+
+
+def _scanned_tables(plan):
+    # 'SCAN projects' reads every row; 'SCAN projects USING ... INDEX' and 'SEARCH ...' use an index.
+    # SQLite before 3.36 said 'SCAN TABLE projects'
+    tables = []
+    for detail in plan or []:
+        words = [word for word in detail.split() if word != 'TABLE']
+        if words[0] == 'SCAN' and len(words) == 2 and not words[1].startswith('('):
+            tables.append(words[1])
+    return tables
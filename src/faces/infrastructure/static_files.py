@@ -0,0 +1,190 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+import tempfile
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import werkzeug.security
+import werkzeug.wsgi
+
+from .compression import choose_encoding
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+_IMMUTABLE = 'public, max-age=31536000, immutable'
+_CHUNK_SIZE = 64 * 1024
+
+
+class StaticFiles:
+    def __init__(self, exports, fingerprint=False, compress=False, cache_dir=None, reload=False):
+        self._exports = {url_path.rstrip('/'): Path(directory) for url_path, directory in exports.items()}
+        self._fingerprint = fingerprint
+        self._compress = compress
+        self._reload = reload
+        # Variants are named by content hash, so they can be shared between processes and kept across restarts
+        self._cache_dir = (Path(cache_dir) if cache_dir else _private_cache_dir()) if compress else None
+        self._assets = {}
+        self._hashed_urls = {}
+        if cache_dir and compress:
+            self._cache_dir.mkdir(parents=True, exist_ok=True)
+
+        for url_path, directory in self._exports.items():
+            for path in sorted(directory.rglob('*')):
+                if path.is_file():
+                    self._add(url_path, directory, path)
+        # Assets are only read here, so one digest covers the process's lifetime
+        hashed = hashlib.sha256()
+        for url in sorted(self._assets):
+            hashed.update(f'{url}={self._assets[url].digest};'.encode())
+        self._digest = hashed.hexdigest()[:12]
+
+    def digest(self):
+        return self._digest
+
+    def url(self, name):
+        if not name.startswith('/'):
+            name = f'{next(iter(self._exports))}/{name}'
+        return self._hashed_urls.get(name, name)
+
+    def handles(self, environ):
+        return environ['REQUEST_METHOD'] in ('GET', 'HEAD') and self._asset(environ.get('PATH_INFO')) is not None
+
+    def wrap(self, app):
+        def serve(environ, start_response):
+            if self.handles(environ):
+                return self.serve(environ, start_response)
+            return app(environ, start_response)
+
+        return serve
+
+    def _add(self, url_path, directory, path):
+        content = path.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        url = f'{url_path}/{path.relative_to(directory).as_posix()}'
+        mimetype = _mimetype(path)
+        asset = _Asset(path, mimetype, digest, immutable=False)
+
+        if self._compress and mimetype.startswith(_COMPRESSIBLE):
+            self._add_variant(asset, 'gzip', content, lambda: gzip.compress(content, compresslevel=9), gzip.decompress)
+            if brotli:
+                self._add_variant(asset, 'br', content, lambda: brotli.compress(content, quality=11), brotli.decompress)
+
+        self._assets[url] = asset
+        if self._fingerprint:
+            hashed_url = url.rsplit('/', 1)[0] + '/' + _hashed_name(path.name, digest)
+            self._assets[hashed_url] = _Asset(path, mimetype, digest, immutable=True, variants=asset.variants)
+            self._hashed_urls[url] = hashed_url
+
+    def _add_variant(self, asset, encoding, content, compress, decompress):
+        variant = self._cache_dir / f'{asset.digest}.{encoding}'
+        if not _holds(variant, content, decompress):
+            compressed = compress()
+            if len(compressed) >= len(content):
+                return
+            partial = variant.with_name(f'{variant.name}.{os.getpid()}')
+            partial.write_bytes(compressed)
+            partial.replace(variant)
+        asset.variants[encoding] = variant
+
+    def _asset(self, url):
+        if not self._reload:
+            return self._assets.get(url)
+        # Files are edited and added while a development server runs, so each request looks again
+        path = self._find(url)
+        if path is None:
+            return None
+        info = path.stat()
+        return _Asset(path, _mimetype(path), f'{info.st_mtime_ns:x}-{info.st_size:x}', immutable=False)
+
+    def _find(self, url):
+        for url_path, directory in self._exports.items():
+            if url and url.startswith(f'{url_path}/'):
+                name = werkzeug.security.safe_join(str(directory), url[len(url_path) + 1:])
+                if name and os.path.isfile(name):
+                    return Path(name)
+        return None
+
+    def serve(self, environ, start_response):
+        asset = self._asset(environ['PATH_INFO'])
+        etag = f'"{asset.digest}"'
+        headers = [
+            ('Cache-Control', _IMMUTABLE if asset.immutable else 'no-cache'),
+            ('ETag', etag),
+            ('Vary', 'Accept-Encoding'),
+        ]
+
+        if not asset.immutable and etag in environ.get('HTTP_IF_NONE_MATCH', ''):
+            start_response('304 Not Modified', headers)
+            return []
+
+        encoding, path = _negotiate(asset, environ.get('HTTP_ACCEPT_ENCODING'))
+        headers += [('Content-Type', asset.content_type), ('Content-Length', str(path.stat().st_size))]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        start_response('200 OK', headers)
+
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+        # Servers that provide a file wrapper can hand the file straight to sendfile()
+        file_wrapper = environ.get('wsgi.file_wrapper', werkzeug.wsgi.FileWrapper)
+        return file_wrapper(path.open('rb'), _CHUNK_SIZE)
+
+
+@dataclass
+class _Asset:
+    path: Path
+    mimetype: str
+    digest: str
+    immutable: bool
+    variants: dict = field(default_factory=dict)
+
+    @property
+    def content_type(self):
+        if self.mimetype.startswith('text/') or self.mimetype == 'application/javascript':
+            return f'{self.mimetype}; charset=utf-8'
+        return self.mimetype
+
+
+def _mimetype(path):
+    return mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+
+
+def _private_cache_dir():
+    # Shared temp directories are writable by everyone, so the default is one only this user can write to
+    directory = Path(tempfile.gettempdir()) / f'faces-static-{os.getuid()}'
+    try:
+        directory.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f'{directory} must be a directory that only the current user can access; '
+                           f'remove it or set FACES_STATIC_CACHE_DIR')
+    return directory
+
+
+def _holds(variant, content, decompress):
+    # A cached variant is only served if it still decompresses to the file it was made from
+    try:
+        return decompress(variant.read_bytes()) == content
+    except Exception:
+        return False
+
+
+def _hashed_name(name, digest):
+    stem, dot, suffix = name.rpartition('.')
+    return f'{stem}.{digest}.{suffix}' if dot else f'{name}.{digest}'
+
+
+def _negotiate(asset, accept_encoding):
+    encoding = choose_encoding(accept_encoding, [e for e in ('br', 'gzip') if e in asset.variants])
+    if encoding is None:
+        return None, asset.path
+    return encoding, asset.variants[encoding]
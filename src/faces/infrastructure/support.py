@@ -1,20 +1,142 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+
 class OutputTracker:
-    def __init__(self):
-        self._current_batch = []
-        self._batches = []
+    def __init__(self, max_batches=None, max_batch_size=None, enabled=True):
+        self._enabled = enabled
+        self._max_batch_size = max_batch_size
+        self._current_batch = deque(maxlen=max_batch_size)
+        self._batches = deque(maxlen=max_batches)
+        self._last_output = _NOTHING
+
+    @classmethod
+    def create(cls):
+        max_batches = setting('output_tracking_batches', 0, int)
+        if not max_batches:
+            return cls.disabled()
+        return cls(max_batches=max_batches, max_batch_size=setting('output_tracking_batch_size', 1000, int))
+
+    @classmethod
+    def disabled(cls):
+        return cls(enabled=False)
 
     def end_batch(self):
-        self._batches.append(self._current_batch)
-        self._current_batch = []
+        if not self._enabled:
+            return
+        self._batches.append(list(self._current_batch))
+        self._current_batch = deque(maxlen=self._max_batch_size)
+
+    def add_batch(self, items):
+        # Outputs added one at a time before this belong to their own batch, not to this one
+        if not self._enabled:
+            return
+        if self._current_batch:
+            self.end_batch()
+        for item in items:
+            self.add(item)
+        self.end_batch()
 
     def add(self, data):
+        if not self._enabled:
+            return
         self._current_batch.append(data)
+        self._last_output = data
 
     def last_output(self):
-        return self.all_outputs()[-1]
+        if self._last_output is _NOTHING:
+            raise IndexError('no output has been tracked')
+        return self._last_output
 
     def all_outputs(self):
-        return sum(self._batches, []) + self._current_batch
+        return [*itertools.chain.from_iterable(self._batches), *self._current_batch]
 
     def last_batch(self):
         return self._batches[-1]
+
+
+_NOTHING = object()
+
+
+class Cache:
+    def __init__(self, max_entries=256, ttl=5.0, clock=time.monotonic):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+            generation = self._generation
+
+        value = load()
+
+        with self._lock:
+            # Don't store a value that was loaded before an invalidation
+            if generation == self._generation:
+                self._entries[key] = (self._clock() + self._ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._entries)}
+
+
+class StartupReport:
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._mark = clock()
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase, seconds=None):
+        # Without an explicit duration a phase lasts from the end of the previous one
+        with self._lock:
+            if seconds is None:
+                now = self._clock()
+                seconds, self._mark = now - self._mark, now
+            if phase in self._phases:
+                return False
+            self._phases[phase] = seconds
+            return True
+
+    def phases(self):
+        with self._lock:
+            return dict(self._phases)
+
+    def __str__(self):
+        phases = self.phases()
+        parts = ', '.join(f'{phase} {seconds * 1000:.0f}ms' for phase, seconds in phases.items())
+        return f'startup: {parts} (total {sum(phases.values()) * 1000:.0f}ms)'
+
+
+def setting(name, default, convert=str):
+    value = os.environ.get(f'FACES_{name.upper()}')
+    if value is None:
+        return default
+    return convert(value)
+
+
+def flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,118 @@
+import functools
+import hashlib
+import threading
+import time
+
+# Jinja yields a few bytes at a time; each piece would otherwise go out as its own chunked frame
+STREAM_BUFFER = 8 * 1024
+
+
+class Templates:
+    def __init__(self, directory, production=False, cache_dir=None, globals=None, precompile=None):
+        self._directory = directory
+        self._cache_dir = cache_dir
+        self._globals = globals or {}
+        self._production = production
+        self._digest = None
+        self._compiled = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+        if precompile is None:
+            precompile = production
+        if precompile:
+            self.precompile()
+
+    @functools.cached_property
+    def _environment(self):
+        # Jinja2 is loaded on first use, so that with a warm start it is imported behind the open socket
+        import jinja2
+
+        options = {}
+        if self._production:
+            options = {
+                'auto_reload': False,
+                'cache_size': -1,
+                'bytecode_cache': jinja2.FileSystemBytecodeCache(self._cache_dir),
+            }
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(self._directory),
+            autoescape=True,
+            **options
+        )
+        environment.globals.update(self._globals)
+        return environment
+
+    def precompile(self):
+        for name in self._environment.list_templates(filter_func=lambda n: n.endswith('.jinja')):
+            self._compiled[name] = self._environment.get_template(name)
+
+    def digest(self):
+        # Production never reloads templates, so their digest can't change while the process runs
+        if self._digest and self._production:
+            return self._digest
+        hashed = hashlib.sha256()
+        for name in sorted(self._environment.list_templates()):
+            source, _, _ = self._environment.loader.get_source(self._environment, name)
+            hashed.update(name.encode() + b'\0' + source.encode() + b'\0')
+        self._digest = hashed.hexdigest()[:12]
+        return self._digest
+
+    def render(self, name, context, block=None):
+        template = self._get(name)
+        started = time.perf_counter()
+        try:
+            if block is None:
+                return template.render(context)
+            return ''.join(self._block(template, block, context))
+        finally:
+            self._record(_timing_name(name, block), time.perf_counter() - started)
+
+    def generate(self, name, context, block=None, buffer_size=STREAM_BUFFER):
+        template = self._get(name)
+        elapsed = 0.0
+        try:
+            chunks = template.generate(context) if block is None else self._block(template, block, context)
+            buffered, size = [], 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - started
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= buffer_size:
+                    yield ''.join(buffered)
+                    buffered, size = [], 0
+            if buffered:
+                yield ''.join(buffered)
+        finally:
+            self._record(_timing_name(name, block), elapsed)
+
+    def render_times(self):
+        with self._lock:
+            return {name: dict(timing) for name, timing in self._timings.items()}
+
+    def _get(self, name):
+        template = self._compiled.get(name)
+        if template is None:
+            template = self._environment.get_template(name)
+        return template
+
+    @staticmethod
+    def _block(template, block, context):
+        return template.blocks[block](template.new_context(context))
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            timing = self._timings.setdefault(name, {'count': 0, 'seconds_total': 0.0, 'seconds_max': 0.0})
+            timing['count'] += 1
+            timing['seconds_total'] += elapsed
+            timing['seconds_max'] = max(timing['seconds_max'], elapsed)
+
+
+def _timing_name(name, block):
+    return name if block is None else f'{name}#{block}'
@@ -0,0 +1,62 @@
+import threading
+
+from .admission import Admission
+from .metrics import Metrics
+
+
+def test_admits_up_to_the_limit_and_then_queues_for_a_free_slot():
+    admission = Admission(limit=1, timeout=5.0)
+    assert admission.enter()
+
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(admission.enter()))
+    waiter.start()
+    admission.leave()
+    waiter.join()
+
+    assert admitted == [True]
+
+
+def test_sheds_a_request_that_waits_too_long():
+    metrics = Metrics()
+    admission = Admission(limit=1, timeout=0.01, metrics=metrics)
+    assert admission.enter(route='index')
+
+    assert not admission.enter(route='index')
+    assert not admission.enter(route='index', waited=0.5), "Time spent before admission counts"
+    assert metrics.value('http_requests_shed_total', (('route', 'index'), ('reason', 'timeout'))) == 2
+    assert metrics.value('http_requests_queued_total', (('route', 'index'),)) == 1
+
+
+def test_a_full_queue_turns_away_the_lowest_priority():
+    metrics = Metrics()
+    admission = Admission(limit=1, queue_size=1, timeout=5.0, metrics=metrics)
+    assert admission.enter()
+
+    results = {}
+
+    def enter(priority):
+        results[priority] = admission.enter(priority, route=priority)
+
+    low = threading.Thread(target=enter, args=('low',))
+    low.start()
+    wait_for(lambda: metrics.value('http_requests_queued_total', (('route', 'low'),)))
+    high = threading.Thread(target=enter, args=('high',))
+    high.start()
+    low.join()
+    assert results == {'low': False}, "The waiting bulk request makes way"
+
+    assert not admission.enter('normal', route='normal'), "A full queue of better requests sheds newcomers"
+    admission.leave()
+    high.join()
+    assert results == {'low': False, 'high': True}
+    assert metrics.value('http_requests_shed_total', (('route', 'low'), ('reason', 'evicted'))) == 1
+    assert metrics.value('http_requests_shed_total', (('route', 'normal'), ('reason', 'queue_full'))) == 1
+
+
+def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError('Timed out')
@@ -0,0 +1,292 @@
+import asyncio
+import contextvars
+import gzip
+import threading
+import time
+
+import werkzeug
+
+from faces.infrastructure.asgi_server import AsgiHttpServer
+from faces.infrastructure.events import EventHub
+
+
+def test_serve_a_string_from_a_synchronous_endpoint():
+    http_server = AsgiHttpServer()
+
+    def index(_request):
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    status, body, _ = request(http_server, 'GET', '/')
+    assert status == 200
+    assert body == 'fish'
+
+
+def test_serve_a_string_from_an_asynchronous_endpoint():
+    http_server = AsgiHttpServer()
+
+    async def index(_request):
+        await asyncio.sleep(0)
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    status, body, _ = request(http_server, 'GET', '/')
+    assert status == 200
+    assert body == 'fish'
+
+
+def test_serve_a_static_file(tmp_path):
+    http_server = AsgiHttpServer()
+
+    (tmp_path / 'a_file.html').write_text('fish')
+    http_server.configure([], {'/static': tmp_path}, '')
+
+    status, body, _ = request(http_server, 'GET', '/static/a_file.html')
+    assert status == 200
+    assert body == 'fish'
+
+
+def test_serve_a_streamed_template(tmp_path):
+    http_server = AsgiHttpServer()
+
+    def a_file(_request):
+        return http_server.render('a_file', stream=True, things=['fish', 'chips'])
+
+    (tmp_path / 'a_file.jinja').write_text('{% for thing in things %}{{thing}}{% endfor %}')
+    http_server.configure([('/a_file', a_file, ['GET'])], {}, tmp_path)
+
+    status, body, _ = request(http_server, 'GET', '/a_file')
+    assert status == 200
+    assert body == 'fishchips'
+
+
+def test_sends_a_streamed_body_in_batches():
+    http_server = AsgiHttpServer()
+
+    def pieces(_request):
+        return werkzeug.Response(b'<li>fish</li>' for _ in range(2000))
+
+    http_server.configure([('/pieces', pieces, ['GET'])], {}, '')
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    scope = {'type': 'http', 'method': 'GET', 'path': '/pieces', 'query_string': b'', 'headers': []}
+    asyncio.run(http_server(scope, receive, send))
+
+    bodies = [message['body'] for message in sent[1:]]
+    assert b''.join(bodies) == b'<li>fish</li>' * 2000
+    assert len(bodies) < 10
+
+
+def test_runs_synchronous_endpoints_on_a_pool_of_the_configured_size():
+    http_server = AsgiHttpServer(threads=1)
+    threads = set()
+
+    def index(_request):
+        threads.add(threading.get_ident())
+        time.sleep(0.01)
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    async def concurrent_requests():
+        await asyncio.gather(*[asgi_request(http_server, 'GET', '/') for _ in range(4)])
+
+    asyncio.run(concurrent_requests())
+    assert len(threads) == 1
+
+
+def test_redirect_for_prg_flow():
+    http_server = AsgiHttpServer()
+
+    def a_redirect(_request):
+        return http_server.redirect('other')
+
+    def other(_request):
+        pass
+
+    http_server.configure([
+        ('/a_redirect', a_redirect, ['PUT']),
+        ('/other', other, ['GET']),
+    ], {}, '')
+
+    status, _, headers = request(http_server, 'PUT', '/a_redirect')
+    assert status == 303
+    assert headers['location'] == '/other'
+
+
+def test_runs_start_listeners_on_lifespan_startup():
+    http_server = AsgiHttpServer()
+    starts = []
+    http_server.lifecycle.add_start_listener(lambda: starts.append('sync'))
+
+    async def start():
+        starts.append('async')
+
+    http_server.lifecycle.add_start_listener(start)
+
+    messages = asyncio.run(lifespan(http_server))
+
+    assert starts == ['sync', 'async']
+    assert messages == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+
+def test_request_listeners_share_the_endpoint_context():
+    http_server = AsgiHttpServer()
+    connection = contextvars.ContextVar('connection')
+    events = []
+
+    def index(_request):
+        connection.set('the connection')
+        return werkzeug.Response('fish')
+
+    async def async_success():
+        events.append('async success')
+
+    http_server.lifecycle.add_request_listener(
+        success=lambda: events.append(connection.get(None)), failure=lambda: events.append('failure')
+    )
+    http_server.lifecycle.add_request_listener(success=async_success, failure=async_success)
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    request(http_server, 'GET', '/')
+
+    assert events == ['the connection', 'async success']
+
+
+def test_requests_do_not_share_context_through_worker_threads():
+    http_server = AsgiHttpServer()
+    connection = contextvars.ContextVar('connection')
+    seen = []
+
+    def index(_request):
+        seen.append(connection.get(None))
+        connection.set('a connection')
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    async def two_requests():
+        await asgi_request(http_server, 'GET', '/')
+        await asgi_request(http_server, 'GET', '/')
+
+    contextvars.Context().run(asyncio.run, two_requests())
+
+    assert seen == [None, None]
+
+
+def test_request_failure_on_http_errors():
+    http_server = AsgiHttpServer()
+    events = []
+    http_server.lifecycle.add_request_listener(
+        success=lambda: events.append('success'), failure=lambda: events.append('failure')
+    )
+    http_server.configure([], {}, '')
+
+    status, _, _ = request(http_server, 'GET', '/missing')
+
+    assert status == 404
+    assert events == ['failure']
+
+
+def test_created_server_compresses_and_records_metrics_like_the_wsgi_server(monkeypatch, capsys):
+    monkeypatch.setenv('FACES_METRICS', '1')
+    monkeypatch.setenv('FACES_PROCESSES', '2')
+    http_server = AsgiHttpServer.create()
+    assert 'ignores the processes setting' in capsys.readouterr().err
+
+    def page(_request):
+        return werkzeug.Response('fish ' * 200, mimetype='text/html')
+
+    http_server.configure([('/page', page, ['GET'])], {}, '')
+
+    status, body, headers = request(http_server, 'GET', '/page', raw=True,
+                                    headers=[(b'accept-encoding', b'gzip')])
+    assert (status, headers['content-encoding']) == (200, 'gzip')
+    assert gzip.decompress(body) == b'fish ' * 200
+
+    _, metrics, _ = request(http_server, 'GET', '/metrics')
+    assert 'http_responses_total{route="page",method="GET",status="200"} 1' in metrics
+
+
+def request(http_server, method, path, headers=(), raw=False):
+    return asyncio.run(asgi_request(http_server, method, path, headers, raw))
+
+
+async def asgi_request(http_server, method, path, headers=(), raw=False):
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': list(headers)}
+    received = [{'type': 'http.request', 'body': b''}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await http_server(scope, receive, send)
+
+    start = sent[0]
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    body = b''.join(message.get('body', b'') for message in sent[1:])
+    return start['status'], body if raw else body.decode(), headers
+
+
+async def lifespan(http_server):
+    received = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    await http_server({'type': 'lifespan'}, receive, send)
+    return sent
+
+
+def test_event_stream_ends_when_the_client_disconnects():
+    http_server = AsgiHttpServer()
+    hub = EventHub()
+
+    def events(_request):
+        return http_server.stream_events(hub)
+
+    http_server.configure([('/events', events, ['GET'])], {}, '')
+
+    async def subscribe():
+        scope = {'type': 'http', 'method': 'GET', 'path': '/events', 'query_string': b'', 'headers': []}
+        disconnect = asyncio.Event()
+        received = [{'type': 'http.request', 'body': b''}]
+        sent = []
+
+        async def receive():
+            if received:
+                return received.pop(0)
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message.get('body') == b': open\n\n':
+                hub.publish('project', 'one')
+            elif message.get('body', b'').startswith(b'event:'):
+                disconnect.set()
+
+        await asyncio.wait_for(http_server(scope, receive, send), 5)
+        return sent
+
+    sent = asyncio.run(subscribe())
+
+    assert sent[0]['headers'][0] == (b'content-type', b'text/event-stream; charset=utf-8')
+    assert sent[-1]['body'] == b'event: project\ndata: one\n\n'
+    assert hub.subscriber_count() == 0
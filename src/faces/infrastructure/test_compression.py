@@ -0,0 +1,83 @@
+import gzip
+import zlib
+
+import pytest
+import werkzeug
+import werkzeug.test
+
+from .compression import CompressionMiddleware
+
+PAGE = '<p>fish</p>' * 100
+
+
+def test_compresses_allowed_responses_for_clients_that_accept_gzip():
+    client = make_client(lambda: werkzeug.Response(PAGE, mimetype='text/html'))
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert 'Content-Length' not in response.headers
+    assert gzip.decompress(response.data).decode() == PAGE
+
+
+def test_leaves_other_responses_alone():
+    small = make_client(lambda: werkzeug.Response('<p>fish</p>', mimetype='text/html'))
+    image = make_client(lambda: werkzeug.Response(PAGE, mimetype='image/png'))
+    page = make_client(lambda: werkzeug.Response(PAGE, mimetype='text/html'))
+
+    assert 'Content-Encoding' not in small.get('/', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in image.get('/', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in page.get('/').headers
+    assert 'Content-Encoding' not in page.get('/', headers={'Accept-Encoding': 'identity'}).headers
+
+
+def test_weakens_etags_of_compressed_responses():
+    def respond():
+        response = werkzeug.Response(PAGE, mimetype='text/html')
+        response.set_etag('v1')
+        return response
+
+    response = make_client(respond).get('/', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['ETag'] == 'W/"v1"'
+
+
+def test_compresses_streamed_responses_as_they_are_produced():
+    produced = []
+
+    def chunks():
+        for i in range(3):
+            produced.append(i)
+            yield PAGE
+
+    middleware = CompressionMiddleware(
+        werkzeug.Response(chunks(), mimetype='text/html'), flush_size=len(PAGE)
+    )
+    environ = werkzeug.test.EnvironBuilder(headers={'Accept-Encoding': 'gzip'}).get_environ()
+    body = middleware(environ, lambda status, headers, exc_info=None: None)
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(next(body)).decode() == PAGE
+    assert produced == [0], "The first chunk is sent before the rest are produced"
+
+    rest = b''.join(body)
+    assert decompressor.decompress(rest).decode() == PAGE * 2
+    assert decompressor.eof
+
+
+def test_prefers_brotli_when_available():
+    brotli = pytest.importorskip('brotli')
+    client = make_client(lambda: werkzeug.Response(PAGE, mimetype='text/html'))
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data).decode() == PAGE
+
+
+def make_client(respond):
+    def app(environ, start_response):
+        return respond()(environ, start_response)
+
+    return werkzeug.test.Client(CompressionMiddleware(app))
@@ -1,10 +1,11 @@
 import threading
 
 import sqlalchemy
+import sqlalchemy.exc
 from sqlalchemy import Text, Table, MetaData, Column
 
 from .http_server import Lifecycle
-from .database import Database
+from .database import Database, pool_arguments
 
 def make_table(db, column):
     table = Table('the_table', MetaData(), Column(column, Text))
@@ -19,6 +20,13 @@ def test_executes_queries():
     rows = list(db.execute(sqlalchemy.select(table.c.foo)))
     assert rows == [('bar',)]
 
+def test_executes_a_statement_for_many_parameter_sets():
+    db = Database('sqlite:///:memory:')
+    table = make_table(db, 'foo')
+    db.execute(sqlalchemy.insert(table), [{'foo': 'bar'}, {'foo': 'baz'}])
+    rows = list(db.execute(sqlalchemy.select(table.c.foo)))
+    assert rows == [('bar',), ('baz',)]
+
 def test_rollback_rolls_back():
     db = Database('sqlite:///:memory:')
     table = make_table(db, 'foo')
@@ -113,3 +121,121 @@ def test_request_failure_triggers_rollback():
     # The row has vanished
     rows = list(db.execute(sqlalchemy.select(table.c.foo)))
     assert not rows
+
+def test_applies_sqlite_pragmas_to_new_connections(tmp_path):
+    uri = f'sqlite+pysqlite:///{tmp_path / "test.db"}'
+    db = Database(uri, sqlite_pragmas={'journal_mode': 'WAL'})
+
+    rows = list(db.execute(sqlalchemy.text('PRAGMA journal_mode')))
+    assert rows == [('wal',)]
+
+def test_reports_pool_checkouts(tmp_path):
+    uri = f'sqlite+pysqlite:///{tmp_path / "test.db"}'
+    db = Database(uri, pool={'pool_size': 2, 'max_overflow': 0})
+
+    db.execute(sqlalchemy.text('SELECT 1'))
+    stats = db.pool_stats()
+    assert stats['checkouts'] == 1
+    assert stats['checked_out'] == 1
+    assert stats['size'] == 2
+
+    db.commit()
+    assert db.pool_stats()['checked_out'] == 0
+
+def test_passes_pool_sizing_only_to_queue_pools(monkeypatch):
+    monkeypatch.setenv('FACES_DATABASE_URI', 'sqlite:///:memory:')
+    db = Database.create(Lifecycle())
+
+    assert list(db.execute(sqlalchemy.text('SELECT 1'))) == [(1,)]
+
+def test_pings_pooled_connections_only_for_networked_databases():
+    pool = {'pool_pre_ping': None, 'pool_size': 5}
+
+    assert pool_arguments('sqlite:///faces.db', pool) == {'pool_pre_ping': False, 'pool_size': 5}
+    assert pool_arguments('postgresql://db/faces', pool) == {'pool_pre_ping': True, 'pool_size': 5}
+    assert pool_arguments('sqlite:///faces.db', {'pool_pre_ping': True})['pool_pre_ping'] is True
+
+def test_records_statement_metrics_per_request():
+    lifecycle = Lifecycle()
+    db = Database('sqlite:///:memory:', lifecycle)
+    db.execute(sqlalchemy.text('SELECT 1'))
+    db.execute(sqlalchemy.text('SELECT 2'))
+    lifecycle.request_success()
+
+    metrics = lifecycle.metrics
+    assert metrics.value('db_statement_duration_seconds', (('statement', 'TextClause'),)) == 2
+    assert metrics.value('db_statements_per_request') == 1
+    assert 'db_statements_per_request_sum 2' in metrics.render()
+
+def test_reads_from_the_replica_until_the_context_uses_the_primary(tmp_path):
+    primary_uri = f'sqlite+pysqlite:///{tmp_path / "primary.db"}'
+    replica_uri = f'sqlite+pysqlite:///{tmp_path / "replica.db"}'
+    replica = Database(replica_uri)
+    table = make_table(replica, 'foo')
+    replica.execute(sqlalchemy.insert(table).values(foo='replica'))
+    replica.commit()
+
+    db = Database(primary_uri, replica_uri=replica_uri)
+    make_table(db, 'foo')
+    assert list(db.read(sqlalchemy.select(table.c.foo))) == [('replica',)]
+
+    # Having written, the request reads its own writes from the primary
+    db.execute(sqlalchemy.insert(table).values(foo='primary'))
+    assert list(db.read(sqlalchemy.select(table.c.foo))) == [('primary',)]
+
+    db.commit()
+    assert list(db.read(sqlalchemy.select(table.c.foo))) == [('replica',)]
+
+def test_a_read_only_connection_can_stand_in_for_a_replica(tmp_path):
+    path = tmp_path / "test.db"
+    db = Database(f'sqlite+pysqlite:///{path}', replica_uri=f'sqlite+pysqlite:///file:{path}?mode=ro&uri=true')
+    table = make_table(db, 'foo')
+    db.execute(sqlalchemy.insert(table).values(foo='bar'))
+    db.commit()
+
+    assert list(db.read(sqlalchemy.select(table.c.foo))) == [('bar',)]
+
+def test_group_commit_applies_concurrent_transactions_together(tmp_path):
+    uri = f'sqlite+pysqlite:///{tmp_path / "test.db"}'
+    lifecycle = Lifecycle()
+    db = Database(uri, lifecycle, sqlite_pragmas={'journal_mode': 'WAL'}, group_commit={'max_wait': 0.5})
+    table = Table('the_table', MetaData(), Column('foo', Text, unique=True))
+    db.execute(sqlalchemy.schema.CreateTable(table))
+    db.execute(sqlalchemy.insert(table).values(foo='taken'))
+    db.commit()
+
+    def create(name, results):
+        db.write(sqlalchemy.insert(table).values(foo=name))
+        try:
+            db.commit()
+        except sqlalchemy.exc.IntegrityError:
+            results[name] = 'failed'
+        else:
+            results[name] = 'committed'
+
+    results = {}
+    threads = [threading.Thread(target=create, args=(name, results)) for name in ['new', 'taken', 'other']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {'new': 'committed', 'taken': 'failed', 'other': 'committed'}
+    assert sorted(db.execute(sqlalchemy.select(table.c.foo))) == [('new',), ('other',), ('taken',)]
+    assert lifecycle.metrics.value('db_group_commit_batch_size') == 1
+    assert 'db_group_commit_batch_size_sum 3' in lifecycle.metrics.render()
+
+def test_group_commit_holds_writes_back_until_commit(tmp_path):
+    uri = f'sqlite+pysqlite:///{tmp_path / "test.db"}'
+    db = Database(uri, group_commit={})
+    table = make_table(db, 'foo')
+
+    db.write(sqlalchemy.insert(table).values(foo='bar'))
+    assert not list(db.execute(sqlalchemy.select(table.c.foo)))
+    db.commit()
+    assert list(db.execute(sqlalchemy.select(table.c.foo))) == [('bar',)]
+
+    db.write(sqlalchemy.insert(table).values(foo='baz'))
+    db.rollback()
+    db.commit()
+    assert list(db.execute(sqlalchemy.select(table.c.foo))) == [('bar',)]
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+
+from .events import KEEP_ALIVE, EventHub, encode
+
+
+def test_publishes_to_every_subscriber():
+    hub = EventHub()
+    first, second = hub.subscribe(), hub.subscribe()
+
+    hub.publish('project', '<li>one</li>')
+
+    assert next(iter(first)) == b'event: project\ndata: <li>one</li>\n\n'
+    assert next(iter(second)) == b'event: project\ndata: <li>one</li>\n\n'
+
+
+def test_encodes_each_line_of_data_separately():
+    assert encode('project', 'a\nb') == b'event: project\ndata: a\ndata: b\n\n'
+
+
+def test_drops_a_subscriber_that_falls_behind():
+    hub = EventHub(max_pending=2)
+    slow, fast = hub.subscribe(), hub.subscribe()
+    fast_messages = iter(fast)
+
+    for name in ['one', 'two', 'three']:
+        hub.publish('project', name)
+        assert next(fast_messages) == encode('project', name)
+
+    assert slow.closed
+    assert hub.dropped == 1
+    assert hub.subscriber_count() == 1
+    # What was already queued is still delivered before the stream ends
+    assert list(slow) == [encode('project', 'one'), encode('project', 'two')]
+
+
+def test_refuses_subscribers_beyond_the_limit():
+    hub = EventHub(max_subscribers=1)
+    subscription = hub.subscribe()
+    assert hub.subscribe() is None
+
+    subscription.close()
+    assert hub.subscribe() is not None
+
+
+def test_sends_keep_alives_while_idle():
+    hub = EventHub(heartbeat=0.01)
+    assert next(iter(hub.subscribe())) == KEEP_ALIVE
+
+
+def test_wakes_asynchronous_subscribers_from_other_threads():
+    hub = EventHub()
+
+    async def receive():
+        subscription = hub.subscribe()
+        messages = subscription.__aiter__()
+        waiting = asyncio.ensure_future(messages.__anext__())
+        await asyncio.sleep(0)
+        threading.Thread(target=hub.publish, args=('project', 'one')).start()
+        message = await asyncio.wait_for(waiting, 5)
+        subscription.close()
+        return message, [message async for message in messages]
+
+    assert asyncio.run(receive()) == (encode('project', 'one'), [])
@@ -1,10 +1,16 @@
 import contextlib
+import gzip
 import http.client
+import signal
+import threading
 from threading import Thread
 
+import pytest
 import werkzeug
+import werkzeug.test
 
-from faces.infrastructure.http_server import HttpServer
+from faces.infrastructure.events import EventHub
+from faces.infrastructure.http_server import HttpServer, Lifecycle, _Supervisor
 
 
 def test_serve_a_string():
@@ -48,6 +54,138 @@ def test_serve_a_template(tmp_path):
         assert body == 'fish'
 
 
+def test_streamed_template_finishes_the_request_after_the_last_chunk(tmp_path):
+    http_server = HttpServer()
+    events = []
+    http_server.lifecycle.add_request_listener(
+        success=lambda: events.append('success'), failure=lambda: events.append('failure')
+    )
+
+    def things():
+        for thing in ['fish', 'chips']:
+            events.append(thing)
+            yield thing
+
+    def a_file(_request):
+        return http_server.render('a_file', stream=True, things=things())
+
+    (tmp_path / 'a_file.jinja').write_text('{% for thing in things %}{{thing}}{% endfor %}')
+    http_server.configure([('/a_file', a_file, ['GET'])], {}, tmp_path)
+
+    with running_server(http_server):
+        status, body, _ = request('GET', '/a_file')
+        assert status == 200
+        assert body == 'fishchips'
+
+    assert events == ['fish', 'chips', 'success']
+
+
+def test_conditional_get_of_a_template(tmp_path):
+    http_server = HttpServer()
+
+    def a_file(request):
+        not_modified = http_server.not_modified(request, 'v1')
+        if not_modified:
+            return not_modified
+        return http_server.render('a_file', etag='v1', thing='fish')
+
+    (tmp_path / 'a_file.jinja').write_text('{{thing}}')
+    http_server.configure([('/a_file', a_file, ['GET'])], {}, tmp_path)
+
+    with running_server(http_server):
+        status, body, headers = request('GET', '/a_file')
+        assert status == 200
+        etag = headers['ETag']
+        assert etag.startswith('"v1-')
+
+        status, body, _ = request('GET', '/a_file', headers={'If-None-Match': etag})
+        assert status == 304
+        assert body == ''
+
+        status, _, _ = request('GET', '/a_file', headers={'If-None-Match': '"v0"'})
+        assert status == 200
+
+        # A changed template is a new version of the page, even when the data behind it is the same
+        (tmp_path / 'a_file.jinja').write_text('<p>{{thing}}</p>')
+        status, _, headers = request('GET', '/a_file', headers={'If-None-Match': etag})
+        assert status == 200
+        assert headers['ETag'] != etag
+
+
+def test_exports_request_metrics():
+    http_server = HttpServer(metrics_route=True)
+
+    def index(_request):
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    with running_server(http_server):
+        request('GET', '/')
+        request('GET', '/missing')
+        status, body, headers = request('GET', '/metrics')
+
+    assert status == 200
+    assert headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert 'http_responses_total{route="index",method="GET",status="200"} 1' in body
+    assert 'http_responses_total{route="unmatched",method="GET",status="404"} 1' in body
+    assert 'http_request_duration_seconds_count{route="index",method="GET"} 1' in body
+    assert 'http_requests_in_flight 1' in body, "Only the metrics request itself is in flight"
+
+
+def test_compressed_templates_still_answer_conditional_gets(tmp_path):
+    http_server = HttpServer(compression={})
+
+    def a_file(request):
+        not_modified = http_server.not_modified(request, 'v1')
+        if not_modified:
+            return not_modified
+        return http_server.render('a_file', etag='v1', thing='fish')
+
+    (tmp_path / 'a_file.jinja').write_text('{{thing}}' * 200)
+    http_server.configure([('/a_file', a_file, ['GET'])], {}, tmp_path)
+
+    with running_server(http_server):
+        conn = http.client.HTTPConnection('127.0.0.1', 5000)
+        conn.request('GET', '/a_file', headers={'Accept-Encoding': 'gzip'})
+        resp = conn.getresponse()
+        assert resp.getheader('Content-Encoding') == 'gzip'
+        assert gzip.decompress(resp.read()).decode() == 'fish' * 200
+
+        status, _, _ = request('GET', '/a_file', headers={'If-None-Match': resp.getheader('ETag')})
+        assert status == 304
+
+
+def test_routes_static_and_parameterised_paths():
+    http_server = HttpServer()
+
+    def projects(_request):
+        return werkzeug.Response('all')
+
+    def project(_request, project_id):
+        return werkzeug.Response(f'project {project_id}')
+
+    def rename(_request, project_id):
+        return werkzeug.Response(f'renamed {project_id}')
+
+    http_server.configure([
+        ('/projects', projects, ['GET']),
+        ('/projects/<int:project_id>', project, ['GET']),
+        ('/projects/<int:project_id>/name', rename, ['PUT']),
+    ], {}, '')
+    client = werkzeug.test.Client(http_server.wsgi_app())
+
+    assert client.get('/projects').text == 'all'
+    assert client.get('/projects/7').text == 'project 7'
+    assert client.put('/projects/7/name').text == 'renamed 7'
+    assert client.get('/nothing').status_code == 404
+
+    response = client.delete('/projects')
+    assert response.status_code == 405
+    assert response.headers['Allow'] == 'GET, HEAD'
+    assert client.get('/projects/7/name').headers['Allow'] == 'PUT'
+
+
 def test_redirect_for_prg_flow():
     http_server = HttpServer()
 
@@ -68,9 +206,151 @@ def test_redirect_for_prg_flow():
         assert headers['Location'] == '/other'
 
 
-def request(method, path):
+def test_event_streams_take_at_most_half_the_worker_pool():
+    http_server = HttpServer(production=True, threads=2)
+    hub = EventHub()
+
+    def events(_request):
+        return http_server.stream_events(hub)
+
+    http_server.configure([('/events', events, ['GET'])], {}, '')
+
+    with running_server(http_server):
+        conn = http.client.HTTPConnection('127.0.0.1', 5000)
+        conn.request('GET', '/events')
+        resp = conn.getresponse()
+        assert resp.getheader('Content-Type') == 'text/event-stream; charset=utf-8'
+
+        assert resp.readline() == b': open\n'
+        assert resp.readline() == b'\n'
+
+        hub.publish('project', 'one')
+        assert resp.readline() == b'event: project\n'
+        status, _, headers = request('GET', '/events')
+        assert status == 503
+        assert headers['Retry-After'] == '5'
+    # Shutting down ended the open stream rather than waiting for it
+    conn.close()
+
+
+def test_sheds_bulk_writes_while_busy_and_keeps_serving_reads():
+    http_server = HttpServer(admission={'limit': 1, 'queue_size': 1, 'timeout': 5.0})
+    outcomes = []
+    http_server.lifecycle.add_request_listener(success=lambda: outcomes.append('commit'),
+                                               failure=lambda: outcomes.append('rollback'))
+    busy, release = threading.Event(), threading.Event()
+
+    def slow(_request):
+        busy.set()
+        release.wait()
+        return werkzeug.Response('slow')
+
+    def index(_request):
+        return werkzeug.Response('index')
+
+    def bulk(_request):
+        return werkzeug.Response('bulk')
+
+    http_server.configure([('/slow', slow, ['GET']), ('/', index, ['GET']), ('/bulk', bulk, ['POST'])], {}, '',
+                          priorities={'bulk': 'low'})
+    client = werkzeug.test.Client(http_server.wsgi_app())
+    responses = {}
+
+    def get(path):
+        responses[path] = client.get(path)
+
+    slow_request = Thread(target=get, args=('/slow',))
+    slow_request.start()
+    busy.wait()
+    index_request = Thread(target=get, args=('/',))
+    index_request.start()
+    while not http_server.lifecycle.metrics.value('http_requests_queued_total', (('route', 'index'),)):
+        threading.Event().wait(0.01)
+
+    response = client.post('/bulk')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert outcomes == ['rollback'], "Shed requests still finish their transaction"
+
+    release.set()
+    slow_request.join()
+    index_request.join()
+    assert responses['/'].text == 'index'
+    metrics = http_server.lifecycle.metrics.render()
+    assert 'http_requests_shed_total{route="bulk",reason="queue_full"} 1' in metrics
+    assert 'http_admission_active 0' in metrics
+
+
+def test_production_mode_serves_from_a_worker_pool_without_the_debugger():
+    http_server = HttpServer(production=True, threads=2)
+    starts = []
+    http_server.lifecycle.add_start_listener(lambda: starts.append(True))
+
+    def fail(_request):
+        raise RuntimeError('boom')
+
+    http_server.configure([('/fail', fail, ['GET'])], {}, '')
+
+    with running_server(http_server):
+        status, body, _ = request('GET', '/fail')
+        assert status == 500
+        assert 'Traceback' not in body
+
+    assert starts == [True]
+
+
+def test_supervisor_gives_up_when_workers_keep_failing_to_start():
+    def serve(_ready):
+        raise RuntimeError('database unreachable')
+
+    handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+    try:
+        with pytest.raises(SystemExit, match='failed to start 3 times'):
+            _Supervisor(2, serve, max_start_failures=3, backoff=0.01).run()
+    finally:
+        signal.signal(signal.SIGTERM, handlers[0])
+        signal.signal(signal.SIGINT, handlers[1])
+
+
+def test_warm_start_accepts_connections_while_starting_up():
+    http_server = HttpServer(production=True, threads=2, warm_start=True)
+    starting = threading.Event()
+    http_server.lifecycle.add_start_listener(starting.wait)
+
+    def index(_request):
+        return werkzeug.Response('fish')
+
+    http_server.configure([('/', index, ['GET'])], {}, '')
+
+    with running_server(http_server):
+        # The request is accepted straight away and answered once start listeners have run
+        threading.Timer(0.1, starting.set).start()
+        status, body, _ = request('GET', '/')
+        assert (status, body) == (200, 'fish')
+
+    assert set(http_server.startup.phases()) == {'lifecycle start', 'first request'}
+    assert 'startup_phase_seconds{phase="first request"}' in http_server.lifecycle.metrics.render()
+
+
+def test_a_failing_success_listener_fails_the_request_for_later_listeners():
+    lifecycle = Lifecycle()
+    heard = []
+
+    def fail():
+        raise RuntimeError('commit failed')
+
+    lifecycle.add_request_listener(success=lambda: heard.append('first success'), failure=None)
+    lifecycle.add_request_listener(success=fail, failure=None)
+    lifecycle.add_request_listener(success=None, failure=lambda: heard.append('last failure'))
+
+    with pytest.raises(RuntimeError):
+        lifecycle.request_success()
+    assert heard == ['first success', 'last failure']
+
+
+def request(method, path, headers=None):
     conn = http.client.HTTPConnection('127.0.0.1', 5000)
-    conn.request(method, path)
+    conn.request(method, path, headers=headers or {})
     resp = conn.getresponse()
     headers = {name: value for name, value in resp.getheaders()}
     body = b''.join(resp.readlines()).decode()
@@ -0,0 +1,44 @@
+from .metrics import Metrics
+
+
+def test_renders_counters_and_gauges():
+    metrics = Metrics()
+    metrics.describe('things_total', 'counter', 'Things seen')
+    metrics.describe('things_in_flight', 'gauge', 'Things in flight')
+
+    metrics.increment('things_total', (('kind', 'fish'),))
+    metrics.increment('things_total', (('kind', 'fish'),), amount=2)
+    metrics.adjust('things_in_flight', 1)
+
+    assert metrics.render() == (
+        '# HELP things_in_flight Things in flight\n'
+        '# TYPE things_in_flight gauge\n'
+        'things_in_flight 1\n'
+        '# HELP things_total Things seen\n'
+        '# TYPE things_total counter\n'
+        'things_total{kind="fish"} 3\n'
+    )
+
+
+def test_renders_cumulative_histogram_buckets():
+    metrics = Metrics()
+    metrics.describe('latency_seconds', 'histogram', 'Latency', buckets=(0.1, 1.0))
+
+    metrics.observe('latency_seconds', 0.05)
+    metrics.observe('latency_seconds', 0.5)
+    metrics.observe('latency_seconds', 5)
+
+    assert metrics.render().splitlines()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+    ]
+
+
+def test_renders_collected_samples_with_escaped_labels():
+    metrics = Metrics()
+    metrics.add_collector(lambda: [('pool_size', 'gauge', 'Pool size', (('name', 'a "b"'),), 5)])
+
+    assert 'pool_size{name="a \\"b\\""} 5' in metrics.render()
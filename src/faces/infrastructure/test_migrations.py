@@ -0,0 +1,50 @@
+import pytest
+import sqlalchemy
+
+from .database import Database
+from .migrations import Migration, Migrator
+
+
+def test_applies_migrations_in_order_and_records_them():
+    database = Database('sqlite:///:memory:')
+    applied = []
+    migrations = [
+        Migration(2, 'second', lambda db: applied.append(2)),
+        Migration(1, 'first', lambda db: applied.append(1)),
+    ]
+
+    migrator = Migrator(database, migrations)
+    migrator.run()
+
+    assert applied == [1, 2]
+    assert migrator.current_version() == 2
+
+
+def test_skips_migrations_that_have_already_been_applied():
+    database = Database('sqlite:///:memory:')
+    applied = []
+    Migrator(database, [Migration(1, 'first', lambda db: applied.append(1))]).run()
+
+    Migrator(database, [
+        Migration(1, 'first', lambda db: applied.append(1)),
+        Migration(2, 'second', lambda db: applied.append(2)),
+    ]).run()
+
+    assert applied == [1, 2]
+
+
+def test_stops_at_a_failing_migration():
+    database = Database('sqlite:///:memory:')
+
+    def fail(db):
+        db.execute(sqlalchemy.text('SELECT * FROM missing'))
+
+    migrator = Migrator(database, [
+        Migration(1, 'first', lambda db: None),
+        Migration(2, 'broken', fail),
+        Migration(3, 'third', lambda db: None),
+    ])
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        migrator.run()
+
+    assert migrator.current_version() == 1
@@ -0,0 +1,68 @@
+import json
+
+import sqlalchemy
+from sqlalchemy import Text, Table, MetaData, Column
+
+from .database import Database
+from .query_diagnostics import QueryDiagnostics
+
+
+class ListLog:
+    def __init__(self):
+        self.reports = []
+
+    def warning(self, message):
+        self.reports.append(json.loads(message))
+
+    def events(self):
+        return [report['event'] for report in self.reports]
+
+
+def make_db(**kwargs):
+    log = ListLog()
+    db = Database('sqlite:///:memory:', diagnostics=QueryDiagnostics(log=log, **kwargs))
+    table = Table('the_table', MetaData(), Column('foo', Text))
+    db.execute(sqlalchemy.schema.CreateTable(table))
+    db.commit()
+    return db, table, log
+
+def test_reports_a_full_table_scan_once_per_statement_shape():
+    db, table, log = make_db()
+    for value in ['a', 'b']:
+        list(db.execute(sqlalchemy.select(table.c.foo).where(table.c.foo == value)))
+    db.commit()
+    assert log.events() == ['full_scan']
+    assert log.reports[0]['tables'] == ['the_table']
+
+    db.execute(sqlalchemy.text('CREATE INDEX ix_foo ON the_table (foo)'))
+    list(db.execute(sqlalchemy.select(table.c.foo).where(table.c.foo > 'a')))
+    db.commit()
+    assert log.events() == ['full_scan']
+
+def test_reports_repeated_statements_and_budget_overruns_at_the_end_of_the_request():
+    db, table, log = make_db(max_statements=3, repeated_statements=4)
+    db.execute(sqlalchemy.text('CREATE INDEX ix_foo ON the_table (foo)'))
+    db.commit()
+    log.reports.clear()
+
+    for value in ['a', 'b', 'c', 'd']:
+        list(db.execute(sqlalchemy.select(table.c.foo).where(table.c.foo == value)))
+    assert log.events() == []
+
+    db.commit()
+    assert log.events() == ['query_budget_exceeded', 'repeated_statement']
+    assert log.reports[0]['statements'] == 4
+    assert log.reports[1]['count'] == 4
+    assert '?' in log.reports[1]['sql']
+
+    # The count starts over for the next request
+    list(db.execute(sqlalchemy.select(table.c.foo).where(table.c.foo == 'e')))
+    db.rollback()
+    assert len(log.reports) == 2
+
+def test_reports_slow_statements_with_their_plan():
+    db, table, log = make_db(slow_seconds=0)
+    log.reports.clear()
+    list(db.execute(sqlalchemy.select(table.c.foo)))
+    slow = [report for report in log.reports if report['event'] == 'slow_statement']
+    assert slow[0]['plan'] == ['SCAN the_table']
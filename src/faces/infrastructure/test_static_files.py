@@ -0,0 +1,120 @@
+import gzip
+import os
+import stat
+import tempfile
+
+import pytest
+import werkzeug.exceptions
+import werkzeug.test
+
+from .static_files import StaticFiles
+
+
+def test_serves_files_under_their_url(tmp_path):
+    (tmp_path / 'a.js').write_text('fish')
+    client = make_client(StaticFiles({'/static': tmp_path}))
+
+    response = client.get('/static/a.js')
+    assert response.status_code == 200
+    assert response.text == 'fish'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    assert client.get('/static/missing.js').status_code == 404
+
+
+def test_revalidates_unhashed_urls_by_etag(tmp_path):
+    (tmp_path / 'a.js').write_text('fish')
+    client = make_client(StaticFiles({'/static': tmp_path}))
+
+    etag = client.get('/static/a.js').headers['ETag']
+    assert client.get('/static/a.js', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_reloading_revalidates_and_finds_files_as_they_change(tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'a.js').write_text('fish')
+    (tmp_path / 'secret').write_text('hidden')
+    client = make_client(StaticFiles({'/static': static}, reload=True))
+
+    etag = client.get('/static/a.js').headers['ETag']
+    (static / 'a.js').write_text('chips!')
+    response = client.get('/static/a.js', headers={'If-None-Match': etag})
+    assert (response.status_code, response.text) == (200, 'chips!')
+
+    (static / 'b.js').write_text('peas')
+    assert client.get('/static/b.js').text == 'peas'
+    assert client.get('/static/../secret').status_code == 404
+
+
+def test_serves_fingerprinted_urls_as_immutable(tmp_path):
+    (tmp_path / 'a.min.js').write_text('fish')
+    static_files = StaticFiles({'/static': tmp_path}, fingerprint=True)
+    client = make_client(static_files)
+
+    url = static_files.url('a.min.js')
+    assert url.startswith('/static/a.min.') and url.endswith('.js') and url != '/static/a.min.js'
+
+    response = client.get(url)
+    assert response.text == 'fish'
+    assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_serves_precompressed_variants_by_accept_encoding(tmp_path):
+    static, cache = tmp_path / 'static', tmp_path / 'cache'
+    static.mkdir()
+    (static / 'a.js').write_text('fish ' * 100)
+    client = make_client(StaticFiles({'/static': static}, compress=True, cache_dir=cache))
+
+    response = client.get('/static/a.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'fish ' * 100
+
+    response = client.get('/static/a.js')
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'fish ' * 100
+
+
+def test_serves_brotli_when_available(tmp_path):
+    brotli = pytest.importorskip('brotli')
+    (tmp_path / 'a.js').write_text('fish ' * 100)
+    client = make_client(StaticFiles({'/static': tmp_path}, compress=True))
+
+    response = client.get('/static/a.js', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == b'fish ' * 100
+
+
+def test_replaces_a_cached_variant_that_does_not_match_the_file(tmp_path):
+    static, cache = tmp_path / 'static', tmp_path / 'cache'
+    static.mkdir()
+    (static / 'a.js').write_text('fish ' * 100)
+    StaticFiles({'/static': static}, compress=True, cache_dir=cache)
+    for variant in cache.iterdir():
+        variant.write_bytes(gzip.compress(b'<script>evil()</script>'))
+
+    client = make_client(StaticFiles({'/static': static}, compress=True, cache_dir=cache))
+
+    response = client.get('/static/a.js', headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(response.data) == b'fish ' * 100
+
+
+def test_keeps_default_variants_in_a_private_directory(tmp_path, monkeypatch):
+    static, temp = tmp_path / 'static', tmp_path / 'tmp'
+    static.mkdir()
+    temp.mkdir()
+    (static / 'a.js').write_text('fish ' * 100)
+    monkeypatch.setattr(tempfile, 'tempdir', str(temp))
+    StaticFiles({'/static': static}, compress=True)
+
+    cache = temp / f'faces-static-{os.getuid()}'
+    assert stat.S_IMODE(cache.stat().st_mode) == 0o700
+    assert any(cache.iterdir())
+
+    cache.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        StaticFiles({'/static': static}, compress=True)
+
+
+def make_client(static_files):
+    return werkzeug.test.Client(static_files.wrap(werkzeug.exceptions.NotFound()))
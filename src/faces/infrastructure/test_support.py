@@ -0,0 +1,100 @@
+from .support import Cache, OutputTracker, StartupReport
+
+
+def test_cache_loads_each_key_once():
+    cache = Cache()
+    loads = []
+
+    def load():
+        loads.append(True)
+        return 'value'
+
+    assert cache.get('key', load) == 'value'
+    assert cache.get('key', load) == 'value'
+    assert len(loads) == 1
+
+
+def test_cache_entries_expire_after_their_ttl():
+    now = [0.0]
+    cache = Cache(ttl=5, clock=lambda: now[0])
+    cache.get('key', lambda: 'old')
+
+    now[0] = 6
+    assert cache.get('key', lambda: 'new') == 'new'
+
+
+def test_cache_evicts_least_recently_used_entries():
+    cache = Cache(max_entries=2)
+    cache.get('a', lambda: 1)
+    cache.get('b', lambda: 2)
+    cache.get('a', lambda: 1)
+    cache.get('c', lambda: 3)
+
+    assert cache.get('a', lambda: 'reloaded') == 1
+    assert cache.get('b', lambda: 'reloaded') == 'reloaded'
+
+
+def test_cache_does_not_store_values_loaded_across_a_clear():
+    cache = Cache()
+
+    def load():
+        cache.clear()
+        return 'stale'
+
+    cache.get('key', load)
+    assert cache.get('key', lambda: 'fresh') == 'fresh'
+
+
+def test_tracker_returns_outputs_in_order():
+    tracker = OutputTracker()
+    tracker.add(1)
+    tracker.add(2)
+    tracker.end_batch()
+    tracker.add(3)
+
+    assert tracker.all_outputs() == [1, 2, 3]
+    assert tracker.last_output() == 3
+    assert tracker.last_batch() == [1, 2]
+
+
+def test_tracker_keeps_a_whole_batch_apart_from_earlier_outputs():
+    tracker = OutputTracker()
+    tracker.add(1)
+    tracker.add_batch([2, 3])
+
+    assert tracker.last_batch() == [2, 3]
+    assert tracker.all_outputs() == [1, 2, 3]
+
+
+def test_bounded_tracker_keeps_only_recent_batches():
+    tracker = OutputTracker(max_batches=2, max_batch_size=2)
+    for batch in [[1], [2, 3, 4], [5]]:
+        for output in batch:
+            tracker.add(output)
+        tracker.end_batch()
+
+    assert tracker.all_outputs() == [3, 4, 5]
+    assert tracker.last_output() == 5
+
+
+def test_disabled_tracker_keeps_nothing():
+    tracker = OutputTracker.disabled()
+    tracker.add(1)
+    tracker.end_batch()
+
+    assert tracker.all_outputs() == []
+
+
+def test_startup_report_times_consecutive_phases():
+    now = [10.0]
+    report = StartupReport(clock=lambda: now[0])
+
+    now[0] = 10.5
+    assert report.record('import')
+    now[0] = 10.75
+    report.record('configure')
+    assert report.record('first request', seconds=0.25)
+    assert not report.record('first request', seconds=1.0)
+
+    assert report.phases() == {'import': 0.5, 'configure': 0.25, 'first request': 0.25}
+    assert str(report) == 'startup: import 500ms, configure 250ms, first request 250ms (total 1000ms)'
@@ -0,0 +1,57 @@
+from .templates import Templates
+
+
+def test_reloads_changed_templates_in_development(tmp_path):
+    (tmp_path / 'a.jinja').write_text('{{thing}}')
+    templates = Templates(tmp_path)
+    assert templates.render('a.jinja', {'thing': 'fish'}) == 'fish'
+
+    (tmp_path / 'a.jinja').write_text('{{thing}}!')
+    assert templates.render('a.jinja', {'thing': 'fish'}) == 'fish!'
+
+
+def test_precompiles_templates_in_production(tmp_path):
+    directory, cache_dir = tmp_path / 'templates', tmp_path / 'cache'
+    directory.mkdir()
+    cache_dir.mkdir()
+    (directory / 'a.jinja').write_text('{{thing}}')
+
+    templates = Templates(directory, production=True, cache_dir=str(cache_dir))
+
+    # Rendering no longer touches the template directory
+    (directory / 'a.jinja').unlink()
+    assert templates.render('a.jinja', {'thing': 'fish'}) == 'fish'
+    assert list(cache_dir.iterdir()), "Compiled bytecode is cached on disk"
+
+
+def test_records_render_times(tmp_path):
+    (tmp_path / 'a.jinja').write_text('{% for thing in things %}{{thing}}{% endfor %}')
+    templates = Templates(tmp_path)
+
+    templates.render('a.jinja', {'things': ['fish']})
+    assert ''.join(templates.generate('a.jinja', {'things': ['fish', 'chips']})) == 'fishchips'
+
+    timing = templates.render_times()['a.jinja']
+    assert timing['count'] == 2
+    assert timing['seconds_total'] >= timing['seconds_max'] > 0
+
+
+def test_renders_a_single_block(tmp_path):
+    (tmp_path / 'a.jinja').write_text(
+        '<ul>{% for thing in things %}{% block item scoped %}<li>{{thing}}</li>{% endblock %}{% endfor %}</ul>')
+    templates = Templates(tmp_path)
+
+    assert templates.render('a.jinja', {'thing': 'fish'}, block='item') == '<li>fish</li>'
+    assert ''.join(templates.generate('a.jinja', {'thing': 'chips'}, block='item')) == '<li>chips</li>'
+    assert templates.render_times()['a.jinja#item']['count'] == 2
+
+
+def test_streams_in_buffered_pieces(tmp_path):
+    (tmp_path / 'a.jinja').write_text('{% for thing in things %}<li>{{thing}}</li>{% endfor %}')
+    templates = Templates(tmp_path)
+
+    pieces = list(templates.generate('a.jinja', {'things': ['fish'] * 10}, buffer_size=32))
+
+    assert ''.join(pieces) == '<li>fish</li>' * 10
+    assert len(pieces) == 4
+    assert all(len(piece) >= 32 for piece in pieces[:-1])
@@ -1,4 +1,6 @@
-from faces.application import App, Repository, Project
+from faces.application import App, InMemoryRepository, Repository, Project
+from faces.infrastructure.database import Database
+from faces.infrastructure.http_server import Lifecycle
 
 
 def test_all_project():
@@ -15,3 +17,51 @@ def test_create_project():
     app.create_project('some project')
 
     assert repo.output_tracker.last_output() == Project('some project')
+
+def test_all_project_in_memory():
+    projects = [Project(name='p1'), Project(name='p2')]
+    repo = InMemoryRepository.create_null(projects=projects)
+    app = App(repo)
+
+    assert app.all_projects() == projects
+
+def test_create_project_in_memory():
+    repo = InMemoryRepository.create_null()
+    app = App(repo)
+
+    app.create_project('some project')
+
+    assert repo.output_tracker.last_output() == Project('some project')
+
+def test_iterates_over_projects_a_page_at_a_time():
+    database = Database.create_null(responses=[
+        [{'name': 'p1'}, {'name': 'p2'}, {'name': 'p3'}],
+        [{'name': 'p3'}],
+    ])
+    app = App(Repository(database))
+
+    assert list(app.iter_projects(page_size=2)) == [Project('p1'), Project('p2'), Project('p3')]
+
+def test_create_projects():
+    repo = InMemoryRepository.create_null()
+    app = App(repo)
+
+    app.create_projects(['one', 'two'])
+
+    assert repo.output_tracker.last_batch() == [Project('one'), Project('two')]
+    assert app.output_tracker.last_batch() == [Project('one'), Project('two')]
+
+def test_tells_listeners_about_projects_once_they_are_committed():
+    lifecycle = Lifecycle()
+    app = App(InMemoryRepository.create_null(), lifecycle=lifecycle)
+    created = []
+    app.add_project_listener(created.append)
+
+    app.create_project('kept')
+    assert created == []
+    lifecycle.request_success()
+    assert created == [Project('kept')]
+
+    app.create_projects(['lost'])
+    lifecycle.request_failure()
+    assert created == [Project('kept')]
@@ -1,9 +1,11 @@
+import pytest
 import sqlalchemy
-import sqlalchemy.exc
 
-from .application import Repository, Project, tables
+from . import application
+from .application import DuplicateProject, InMemoryRepository, Page, ProjectList, Repository, Project, tables
 from .infrastructure.http_server import Lifecycle
 from .infrastructure.database import Database
+from .infrastructure.support import Cache
 
 
 def test_returns_all_projects():
@@ -14,6 +16,42 @@ def test_returns_all_projects():
     assert projects == [Project('one'), Project('two')]
 
 
+def test_returns_a_page_of_projects_after_a_cursor():
+    database = Database.create_null(response=[{'name': 'b'}, {'name': 'c'}, {'name': 'd'}])
+    page = Repository(database).projects_page(after='a', limit=2)
+
+    name = tables.projects.c.name
+    assert_queries(database.query_tracker.last_output(),
+                   sqlalchemy.select(name).order_by(name).limit(3).where(name > 'a'))
+    assert page == Page([Project('b'), Project('c')], next_after='c')
+
+
+def test_reads_projects_a_chunk_at_a_time(monkeypatch):
+    monkeypatch.setattr(application, 'READ_CHUNK', 2)
+    database = Database.create_null(response=[{'name': 'one'}, {'name': 'two'}, {'name': 'three'}])
+    projects = Repository(database).all_projects()
+
+    assert isinstance(projects, ProjectList)
+    assert projects == [Project('one'), Project('two'), Project('three')]
+    assert (len(projects), projects[-1], projects[1:]) == (3, Project('three'), [Project('two'), Project('three')])
+
+
+def test_last_page_has_no_cursor():
+    database = Database.create_null(response=[{'name': 'a'}])
+    page = Repository(database).projects_page(limit=2)
+
+    assert page == Page([Project('a')], next_after=None)
+
+
+def test_versions_the_project_list_by_its_highest_id():
+    database = Database.create_null(response=[{'max': 3}])
+    version = Repository(database).projects_version()
+
+    assert_queries(database.query_tracker.last_output(),
+                   sqlalchemy.select(sqlalchemy.func.max(tables.projects.c.id)))
+    assert version == 3
+
+
 def test_saves_a_project():
     database = Database.create_null()
     Repository(database).save_project(Project('a'))
@@ -21,27 +59,230 @@ def test_saves_a_project():
     assert_queries(database.query_tracker.last_output(), sqlalchemy.insert(tables.projects).values(name='a'))
 
 
-def test_checks_whether_project_table_exists_on_startup():
+def test_serves_repeated_reads_from_the_cache():
+    database = Database.create_null(response=[{'name': 'one'}])
+    repository = Repository(database, cache=Cache())
+
+    assert repository.all_projects() == repository.all_projects() == [Project('one')]
+
+    assert len(database.query_tracker.all_outputs()) == 1
+    assert repository.cache_stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+
+
+def test_invalidates_the_cache_once_a_write_commits():
+    database = Database.create_null(response=[{'name': 'one'}])
+    lifecycle = Lifecycle()
+    repository = Repository(database, lifecycle, Cache())
+    repository.all_projects()
+
+    repository.save_project(Project('two'))
+    repository.all_projects()
+    assert len(database.query_tracker.all_outputs()) == 3, "The writing request reads around the cache"
+
+    lifecycle.request_success()
+    repository.all_projects()
+    assert len(database.query_tracker.all_outputs()) == 4
+
+
+def test_keeps_the_cache_when_a_write_rolls_back():
+    database = Database.create_null(response=[{'name': 'one'}])
+    lifecycle = Lifecycle()
+    repository = Repository(database, lifecycle, Cache())
+    repository.all_projects()
+
+    repository.save_project(Project('two'))
+    lifecycle.request_failure()
+    repository.all_projects()
+
+    assert len(database.query_tracker.all_outputs()) == 2
+
+
+def test_drops_cached_pages_once_another_worker_moves_the_version(tmp_path):
+    uri = f'sqlite:///{tmp_path / "faces.db"}'
+    workers = []
+    for _ in range(2):
+        lifecycle = Lifecycle()
+        workers.append((Repository(Database(uri, lifecycle), lifecycle, Cache()), lifecycle))
+        lifecycle.start()
+    (a, a_lifecycle), (b, b_lifecycle) = workers
+
+    b.projects_version()
+    assert Project('new') not in b.projects_page().projects
+    b_lifecycle.request_success()
+
+    a.save_project(Project('new'))
+    a_lifecycle.request_success()
+
+    b.projects_version()
+    assert Project('new') in b.projects_page().projects
+
+
+def test_saves_many_projects_in_one_statement():
+    database = Database.create_null()
+    repository = Repository(database)
+    projects = [Project('a'), Project('b')]
+    repository.save_projects(projects)
+
+    assert_queries(database.query_tracker.all_outputs(), [sqlalchemy.insert(tables.projects)])
+    assert repository.output_tracker.last_batch() == projects
+
+
+def test_creates_the_project_table_on_startup():
     database = Database.create_null(response=[])
+    lifecycle = Lifecycle()
+    Repository(database, lifecycle)
+    lifecycle.start()
+
+    statements = [compile(query) for query in database.query_tracker.all_outputs()]
+    assert compile(sqlalchemy.schema.CreateTable(application._legacy_projects)) in statements
+    assert compile(sqlalchemy.insert(application._legacy_projects)
+                   .values([{'name': 'foo'}, {'name': 'bar'}])) in statements
 
+
+def test_keeps_an_existing_project_table_on_startup():
+    database = Database.create_null(tables=['projects'], response=[])
     lifecycle = Lifecycle()
     Repository(database, lifecycle)
     lifecycle.start()
 
-    assert_queries(database.query_tracker.last_output(), sqlalchemy.select(tables.projects.c.name))
+    statements = [compile(query) for query in database.query_tracker.all_outputs()]
+    assert compile(sqlalchemy.schema.CreateTable(application._legacy_projects)) not in statements
+
+
+def test_migrates_a_new_database_on_startup():
+    database = Database('sqlite:///:memory:')
+    lifecycle = Lifecycle()
+    Repository(database, lifecycle)
+    lifecycle.start()
+
+    rows = list(database.execute(
+        sqlalchemy.select(tables.projects.c.id, tables.projects.c.name).order_by(tables.projects.c.id)
+    ))
+    assert rows == [(1, 'foo'), (2, 'bar')]
+    assert database.has_table('schema_migrations')
 
 
-def test_ensures_that_project_table_exists_on_startup():
-    database = Database.create_null(error=sqlalchemy.exc.OperationalError(None, None, None))
+def test_migrates_a_legacy_projects_table_on_startup():
+    database = Database('sqlite:///:memory:')
+    database.execute(sqlalchemy.text('CREATE TABLE projects (name TEXT)'))
+    database.execute(sqlalchemy.text("INSERT INTO projects VALUES ('b'), ('a'), ('b')"))
+    database.commit()
+
     lifecycle = Lifecycle()
     Repository(database, lifecycle)
     lifecycle.start()
 
-    assert_queries(database.query_tracker.last_batch(), [
-        sqlalchemy.select(tables.projects.c.name),
-        sqlalchemy.schema.CreateTable(tables.projects),
-        sqlalchemy.insert(tables.projects).values([{'name': 'foo'}, {'name': 'bar'}])
-    ])
+    rows = list(database.execute(
+        sqlalchemy.select(tables.projects.c.id, tables.projects.c.name).order_by(tables.projects.c.id)
+    ))
+    assert rows == [(1, 'b'), (2, 'a')], "Duplicates are dropped and the original order is kept"
+    with pytest.raises(DuplicateProject):
+        Repository(database).save_project(Project('a'))
+
+
+def test_migrates_only_once():
+    database = Database('sqlite:///:memory:')
+    for _ in range(2):
+        lifecycle = Lifecycle()
+        Repository(database, lifecycle)
+        lifecycle.start()
+
+    rows = list(database.execute(sqlalchemy.select(tables.projects.c.name)))
+    assert rows == [('bar',), ('foo',)]
+
+
+def test_searches_project_names_by_prefix():
+    database = Database('sqlite:///:memory:')
+    lifecycle = Lifecycle()
+    repository = Repository(database, lifecycle)
+    lifecycle.start()
+
+    repository.save_projects([Project('alpha centauri'), Project('beta'), Project('alphabet soup')])
+    database.commit()
+
+    assert sorted(p.name for p in repository.search_projects('alph')) == ['alpha centauri', 'alphabet soup']
+    assert repository.search_projects('soup alph') == [Project('alphabet soup')]
+    assert len(repository.search_projects('alph', limit=1)) == 1
+    assert repository.search_projects('"beta" OR') == []
+    assert repository.search_projects('   ') == []
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def backend(request):
+    # Both repositories keep the same contract; the fixture returns a repository and its commit
+    lifecycle = Lifecycle()
+    if request.param == 'memory':
+        repository = InMemoryRepository(lifecycle=lifecycle)
+    else:
+        database = Database('sqlite:///:memory:', lifecycle)
+        repository = Repository(database, lifecycle)
+        lifecycle.start()
+        database.execute(sqlalchemy.delete(tables.projects))
+        database.commit()
+    return repository, lifecycle.request_success
+
+
+def test_backends_list_page_and_version_saved_projects(backend):
+    repository, commit = backend
+    version = repository.projects_version()
+    repository.save_project(Project('b'))
+    repository.save_projects([Project('c'), Project('a')])
+    commit()
+
+    assert sorted(p.name for p in repository.all_projects()) == ['a', 'b', 'c']
+    assert repository.projects_page(limit=2) == Page([Project('a'), Project('b')], next_after='b')
+    assert repository.projects_page(after='b', limit=2) == Page([Project('c')], next_after=None)
+    assert repository.projects_version() != version
+    assert repository.output_tracker.last_batch() == [Project('c'), Project('a')]
+
+
+def test_backends_search_by_every_term(backend):
+    repository, commit = backend
+    repository.save_projects([Project('alpha centauri'), Project('beta'), Project('Alphabet soup')])
+    commit()
+
+    assert sorted(p.name for p in repository.search_projects('alph')) == ['Alphabet soup', 'alpha centauri']
+    assert repository.search_projects('soup alph') == [Project('Alphabet soup')]
+    assert len(repository.search_projects('alph', limit=1)) == 1
+    assert repository.search_projects('   ') == []
+
+
+def test_in_memory_repository_forgets_projects_from_a_failed_request():
+    lifecycle = Lifecycle()
+    repository = InMemoryRepository([Project('kept')], lifecycle)
+
+    repository.save_project(Project('lost'))
+    assert repository.projects_page() == Page([Project('kept'), Project('lost')], next_after=None)
+    lifecycle.request_failure()
+
+    assert repository.all_projects() == [Project('kept')]
+    assert repository.projects_page() == Page([Project('kept')], next_after=None)
+    repository.save_project(Project('lost'))
+
+
+def test_in_memory_repository_never_reuses_a_version():
+    lifecycle = Lifecycle()
+    repository = InMemoryRepository([Project('kept')], lifecycle)
+    versions = [repository.projects_version()]
+
+    repository.save_project(Project('lost'))
+    versions.append(repository.projects_version())
+    lifecycle.request_failure()
+    versions.append(repository.projects_version())
+    repository.save_project(Project('other'))
+    versions.append(repository.projects_version())
+
+    assert len(set(versions)) == len(versions)
+
+
+def test_in_memory_repository_rejects_duplicate_names():
+    repository = InMemoryRepository([Project('a')])
+
+    with pytest.raises(DuplicateProject):
+        repository.save_project(Project('a'))
+    with pytest.raises(DuplicateProject):
+        repository.save_projects([Project('b'), Project('b')])
+    assert repository.all_projects() == [Project('a')]
 
 
 def assert_queries(lefts, rights):
@@ -1,7 +1,13 @@
+import logging
 import pathlib
 
-from faces.application import App, Web, Project
+import pytest
+import werkzeug.test
+
+from faces.application import App, Repository, Web, Project
+from faces.infrastructure.database import Database
 from faces.infrastructure.fake_server import FakeServer
+from faces.infrastructure.http_server import HttpServer
 
 
 def test_on_index():
@@ -16,6 +22,30 @@ def test_on_index():
     assert 'Projects' in body
     assert 'p1' in body
     assert 'p2' in body
+    assert 'EventSource' in body
+
+
+def test_on_index_is_not_modified_while_the_project_list_is_unchanged():
+    server = FakeServer()
+    app = App.create_null(projects=[Project(name='p1')])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    etag = f'"projects-{app.projects_version()}"'
+    assert server.get('/', headers={'If-None-Match': etag}) == (304, '')
+    assert server.get('/', headers={'If-None-Match': '"projects-stale"'})[0] == 200
+
+
+def test_on_search_projects():
+    server = FakeServer()
+    app = App.create_null(projects=[Project(name='p1')])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    status, body = server.get('/projects/search', args={'q': 'p'})
+
+    assert status == 200
+    assert '<li>p1</li>' in body
 
 
 def test_on_create_project():
@@ -28,3 +58,124 @@ def test_on_create_project():
     assert result == (303, '/')
 
     assert app.output_tracker.last_output() == Project(name="new_project")
+
+
+def test_on_create_project_from_htmx_returns_the_new_item():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    result = server.put('/project', form={'name': 'new_project'}, headers={'HX-Request': 'true'})
+    assert result == (200, '<li data-name="new_project">new_project</li>')
+
+    assert app.output_tracker.last_output() == Project(name="new_project")
+
+
+def test_on_create_project_with_a_taken_name_tells_the_user():
+    server = FakeServer()
+    app = App.create_null(projects=[Project(name='zed')])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    result = server.put('/project', form={'name': 'zed'}, headers={'HX-Request': 'true'})
+    assert result == (409, 'A project with that name already exists')
+
+    result = server.put('/project', form={'name': 'zed'})
+    assert result == (409, {'error': 'A project with that name already exists'})
+
+    result = server.post('/projects', data='["a", "a"]', mimetype='application/json')
+    assert result[0] == 409
+
+
+@pytest.mark.parametrize('group_commit', [None, {'max_batch': 8, 'max_wait': 0.0}])
+def test_a_taken_name_is_a_conflict_even_when_it_fails_at_commit(tmp_path, group_commit):
+    server = HttpServer()
+    database = Database(f'sqlite+pysqlite:///{tmp_path / "test.db"}', server.lifecycle, group_commit=group_commit)
+    app = App(Repository(database, server.lifecycle), lifecycle=server.lifecycle)
+    Web(server, app, pathlib.Path(__file__).parent.parent)
+    server.lifecycle.start()
+    client = werkzeug.test.Client(server.wsgi_app())
+
+    assert client.put('/project', data={'name': 'zed'}).status_code == 303
+    response = client.put('/project', data={'name': 'zed'}, headers={'HX-Request': 'true'})
+
+    assert response.status_code == 409
+    assert response.headers['HX-Retarget'] == '#project-error'
+    assert response.text == 'A project with that name already exists'
+    assert client.post('/projects', json=['a', 'a']).status_code == 409
+    assert sorted(p.name for p in app.all_projects()) == ['bar', 'foo', 'zed']
+
+
+def test_on_create_projects_from_json():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    result = server.post('/projects', data='{"names": ["one", "two"]}', mimetype='application/json')
+    assert result == (201, {'created': 2})
+
+    assert app.output_tracker.last_batch() == [Project(name='one'), Project(name='two')]
+
+
+def test_on_create_projects_from_csv():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    result = server.post('/projects', data='one\n"two, three"\n\n', mimetype='text/csv')
+    assert result == (201, {'created': 2})
+
+    assert app.output_tracker.last_batch() == [Project(name='one'), Project(name='two, three')]
+
+
+def test_on_create_projects_rejects_other_bodies():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    assert server.post('/projects', data='one', mimetype='text/plain')[0] == 415
+    assert server.post('/projects', data='{"names": [1]}', mimetype='application/json')[0] == 400
+
+
+def test_on_events_streams_new_projects():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent)
+    web.run()
+
+    status, events = server.get('/events')
+    assert status == 200
+
+    server.put('/project', form={'name': 'new_project'})
+    assert next(iter(events)) == b'event: project\ndata: <li data-name="new_project">new_project</li>\n\n'
+
+
+def test_without_live_updates_pages_open_no_event_stream():
+    server = FakeServer()
+    app = App.create_null(projects=[])
+    web = Web(server, app, pathlib.Path(__file__).parent.parent, live_updates=False)
+    web.run()
+
+    assert 'EventSource' not in server.get('/')[1]
+    assert server.get('/events') == (404, '')
+
+
+def test_created_web_turns_live_updates_on_only_for_the_asgi_server(monkeypatch, caplog):
+    monkeypatch.setenv('FACES_STORAGE', 'memory')
+    caplog.set_level(logging.INFO, 'faces')
+    root_dir = pathlib.Path(__file__).parent.parent
+
+    web = Web.create(root_dir)
+    client = werkzeug.test.Client(web._server.wsgi_app())
+    assert client.get('/events').status_code == 404
+    assert 'EventSource' not in client.get('/').text
+    assert 'need FACES_SERVER=asgi' in caplog.text
+
+    caplog.clear()
+    monkeypatch.setenv('FACES_SERVER', 'asgi')
+    Web.create(root_dir)
+    assert 'need FACES_SERVER=asgi' not in caplog.text